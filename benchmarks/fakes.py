@@ -0,0 +1,67 @@
+"""
+Deterministic stand-ins for the provider models, so benchmarks measure the pipeline
+itself. Latencies are simulated with sleep and can be set per instance.
+"""
+
+import json
+import time
+import hashlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+
+FAKE_RESULT = {
+    "package_name": "fake-package",
+    "version": "0.1",
+    "TTP": "Typosquatting\ncmd",
+    "ecosystem": "pypi",
+    "analysis_process": {
+        f"step_{i}": {"description": f"Step {i}", "details": "Nothing to report."}
+        for i in range(1, 5)
+    },
+}
+
+
+class FakeLLM(LLM):
+    """
+    FakeLLM answers every prompt with the same analysis JSON after `latency` seconds.
+    """
+
+    latency: float = 0.0
+    response: str = json.dumps(FAKE_RESULT)
+    model_name: str = "fake-llm"
+
+    @property
+    def _llm_type(self):
+        return "fake-benchmark"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self.response
+
+
+class FakeEmbedding(Embeddings):
+    """
+    FakeEmbedding returns unit vectors seeded by the text hash; each call, single or
+    batched, costs `latency` seconds like one provider round-trip.
+    """
+
+    def __init__(self, size=1536, latency=0.0):
+        self.size = size
+        self.latency = latency
+        self.model = "fake-embedding"
+
+    def vector(self, text):
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "big")
+        vector = np.random.RandomState(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self.vector(text)
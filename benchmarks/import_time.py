@@ -0,0 +1,92 @@
+"""
+Measures the cold import time of the webui modules in fresh interpreters:
+
+    python benchmarks/import_time.py --repeat 5 --output import_time.json
+
+Each module is imported with -X importtime; the cumulative time of the module and its
+ten slowest dependencies are reported as JSON. With --max-ms the script exits with 1
+when a module is slower than the limit, so regressions can fail a CI job.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["src.porvider", "src.agents.query", "src.agents.analyze", "pipeline"]
+
+
+def import_times(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        times[parts[2].strip()] = cumulative
+    return times
+
+
+def measure(module, repeat):
+    samples = [import_times(module) for _ in range(repeat)]
+    totals = [times.get(module, 0) / 1000 for times in samples]
+    slowest = sorted(samples[-1].items(), key=lambda item: -item[1])
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(totals), 2),
+        "min_ms": round(min(totals), 2),
+        "slowest_dependencies": [
+            {"module": name, "cumulative_ms": round(us / 1000, 2)}
+            for name, us in slowest
+            if name != module
+        ][:10],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-ms", type=float, default=None)
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for module in args.modules:
+        try:
+            results.append(measure(module, args.repeat))
+        except RuntimeError as e:
+            results.append({"module": module, "error": str(e)})
+    report = json.dumps({"benchmark": "import_time", "results": results}, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if args.max_ms is not None and any(
+        result.get("median_ms", 0) > args.max_ms for result in results
+    ):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
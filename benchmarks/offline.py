@@ -0,0 +1,268 @@
+"""
+Measures the pipeline's own overhead with fake, deterministic LLM and embedding backends:
+
+    python benchmarks/offline.py --llm-latency 0.2 --output offline.json
+
+Covers get_file on synthetic package trees, AnalysisAgent.invoke throughput, the
+add_document import rate, QueryAgent retrieval latency against example/chroma_database
+and JsonlSink throughput. Results are written as JSON so runs can be compared.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import contextlib
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCHMARKS = ["get_file", "analyze", "import", "query", "sink"]
+
+QUESTIONS = [
+    "What TTPs does aiohttp_socks5 use?",
+    "Which packages use typosquatting?",
+    "How do malicious packages execute commands during installation?",
+    "Explain common evasion techniques in pypi malware.",
+]
+
+
+def make_package(target_path, index, files, lines=60):
+    name = f"pkg{index}"
+    os.makedirs(os.path.join(target_path, name), exist_ok=True)
+    with open(os.path.join(target_path, "PKG-INFO"), "w") as f:
+        f.write(f"Metadata-Version: 2.1\nName: {name}\nVersion: 1.{index}\n\n")
+    with open(os.path.join(target_path, "setup.py"), "w") as f:
+        f.write(f"from setuptools import setup\nsetup(name='{name}')\n")
+    for i in range(files):
+        with open(os.path.join(target_path, name, f"module{i}.py"), "w") as f:
+            f.write(
+                "\n".join(
+                    f"def function_{i}_{j}(value):\n    return value * {j}"
+                    for j in range(lines // 2)
+                )
+            )
+
+
+def timed(fn, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[math.ceil(0.95 * len(ordered)) - 1] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def bench_get_file(args, workdir):
+    from src.agents.analyze import get_file
+
+    results = []
+    for files in args.sizes:
+        target_path = os.path.join(workdir, f"tree_{files}")
+        make_package(target_path, 0, files)
+        size = len(get_file(target_path))
+        samples = timed(lambda: get_file(target_path), args.repeat)
+        results.append(
+            {
+                "files": files,
+                "chars": size,
+                "mb_per_s": round(size / statistics.median(samples) / 1e6, 2),
+                **percentiles(samples),
+            }
+        )
+    return results
+
+
+def bench_analyze(args, workdir):
+    from benchmarks.fakes import FakeEmbedding, FakeLLM
+    from src.agents.analyze import AnalysisAgent
+
+    unzip_dir = os.path.join(workdir, "unzip")
+    for i in range(args.packages):
+        make_package(os.path.join(unzip_dir, f"pkg{i}-1.{i}"), i, 10)
+    agent = AnalysisAgent(
+        FakeLLM(latency=args.llm_latency), FakeEmbedding(latency=args.embedding_latency)
+    )
+    agent.load_vectorstore(
+        os.path.join(ROOT, "example", "attack_vector.xlsx"),
+        index_path=os.path.join(workdir, "attack_vector_index"),
+    )
+    results = []
+    for max_workers in args.workers:
+        result_dir = os.path.join(workdir, f"analysis_{max_workers}")
+        elapsed = timed(
+            lambda: list(agent.invoke(unzip_dir, result_dir, max_workers=max_workers))
+        )[0]
+        results.append(
+            {
+                "packages": args.packages,
+                "max_workers": max_workers,
+                "seconds": round(elapsed, 3),
+                "packages_per_s": round(args.packages / elapsed, 2),
+                "errors": len(agent.errors),
+            }
+        )
+    return results
+
+
+def bench_import(args, workdir):
+    from langchain_chroma import Chroma
+    from benchmarks.fakes import FAKE_RESULT, FakeEmbedding
+    from src.utils.data import add_document
+
+    input_dir = os.path.join(workdir, "import")
+    os.makedirs(input_dir)
+    for i in range(args.documents):
+        with open(os.path.join(input_dir, f"pkg{i}.json"), "w") as f:
+            json.dump({**FAKE_RESULT, "package_name": f"pkg{i}"}, f)
+    embedding = FakeEmbedding(latency=args.embedding_latency)
+    collection = Chroma(
+        collection_name="benchmark",
+        persist_directory=os.path.join(workdir, "chroma_database"),
+        embedding_function=embedding,
+    )
+    elapsed = timed(
+        lambda: list(
+            add_document(collection, embedding, input_dir, requests_per_minute=None)
+        )
+    )[0]
+    return [
+        {
+            "documents": args.documents,
+            "seconds": round(elapsed, 3),
+            "documents_per_s": round(args.documents / elapsed, 2),
+        }
+    ]
+
+
+def bench_query(args, workdir):
+    from benchmarks.fakes import FakeEmbedding, FakeLLM
+    from src.agents.query import QueryAgent
+
+    # a copy, so the example database is never written to
+    database_path = os.path.join(workdir, "example_database")
+    shutil.copytree(os.path.join(ROOT, "example", "chroma_database"), database_path)
+    agent = QueryAgent(
+        FakeLLM(latency=args.llm_latency, response="Fake answer."),
+        FakeEmbedding(latency=args.embedding_latency),
+    )
+    load = timed(lambda: agent.load_database(database_path, "my_custom_collection"))
+    results = [{"operation": "load_database", **percentiles(load)}]
+    for question in QUESTIONS:
+        retrieve = timed(lambda: agent.retrieve(question), args.repeat)
+
+        def uncached():
+            agent.answer_cache.clear()
+            agent.invoke(question)
+
+        invoke = timed(uncached, args.repeat)
+        results.append(
+            {"operation": "retrieve", "question": question, **percentiles(retrieve)}
+        )
+        results.append(
+            {"operation": "invoke", "question": question, **percentiles(invoke)}
+        )
+    return results
+
+
+def bench_sink(args, workdir):
+    from src.utils.sink import JsonlSink
+
+    record = {
+        "url": "https://example.com/report",
+        "package_name": "fake-package",
+        "version": "0.1",
+        "TTP": "Typosquatting\ncmd",
+        "ecosystem": "pypi",
+    }
+    path = os.path.join(workdir, "sink.jsonl")
+
+    def write():
+        with JsonlSink(path) as sink:
+            for _ in range(args.records):
+                sink.write(record)
+
+    elapsed = timed(write)[0]
+    return [
+        {
+            "records": args.records,
+            "seconds": round(elapsed, 3),
+            "records_per_s": round(args.records / elapsed, 2),
+            "bytes": os.path.getsize(path),
+        }
+    ]
+
+
+benchmarks = {
+    "get_file": bench_get_file,
+    "analyze": bench_analyze,
+    "import": bench_import,
+    "query": bench_query,
+    "sink": bench_sink,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", default=BENCHMARKS)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--packages", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--documents", type=int, default=500)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument(
+        "--output", default=None, help="write JSON here instead of stdout"
+    )
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    for name in args.benchmarks:
+        workdir = tempfile.mkdtemp(prefix=f"genttp_{name}_")
+        try:
+            # keep progress prints of the code under test out of the JSON report
+            with contextlib.redirect_stdout(sys.stderr):
+                results[name] = benchmarks[name](args, workdir)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+            failed = True
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = json.dumps(
+        {
+            "benchmark": "offline",
+            "time": time.time(),
+            "python": sys.version.split()[0],
+            "llm_latency": args.llm_latency,
+            "embedding_latency": args.embedding_latency,
+            "results": results,
+        },
+        indent=4,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
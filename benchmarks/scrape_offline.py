@@ -0,0 +1,147 @@
+"""
+Runs the web scraping pipeline offline against a local HTTP server serving the fixture
+pages in benchmarks/fixtures/scrape, with a stub extractor in place of the LLM:
+
+    python benchmarks/scrape_offline.py
+
+Checks fetching, the retry of a transient 503, a 404 failing without retries, resuming
+from the checkpoint and the export, and exits with 1 on the first mismatch.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures", "scrape")
+
+PACKAGE_PATTERN = re.compile(r'<li data-package="([^"]+)">([^<]*)</li>')
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the fixture pages and counts the requests per path; flaky.html answers
+    503 to its first request.
+    """
+
+    requests = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            count = self.requests[self.path] = self.requests.get(self.path, 0) + 1
+        if self.path == "/flaky.html" and count == 1:
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+async def stub_extractor(url, html):
+    return [
+        {"malicious_package_name": name, "malicious_package_actions": actions}
+        for name, actions in PACKAGE_PATTERN.findall(html)
+    ]
+
+
+def check(name, actual, expected):
+    if actual != expected:
+        raise AssertionError(f"{name}: expected {expected!r}, got {actual!r}")
+    print(f"ok {name}", file=sys.stderr)
+
+
+def scrape(urls, sink_path, checkpoint_path):
+    from src.agents.webscrap import Checkpoint, HttpFetcher, run_pipeline, to_rows
+    from src.utils.sink import JsonlSink
+
+    async def run():
+        async with HttpFetcher(timeout=5) as fetcher:
+            return await run_pipeline(
+                urls,
+                fetcher,
+                stub_extractor,
+                save=lambda url, items: sink.write_many(to_rows(url, items)),
+                checkpoint=Checkpoint(checkpoint_path),
+                delay=0.0,
+                backoff=0.01,
+            )
+
+    with JsonlSink(sink_path) as sink:
+        return asyncio.run(run())
+
+
+def main():
+    from src.agents.webscrap import export_results
+    from src.utils.sink import read_jsonl
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(FixtureHandler, directory=FIXTURES)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    workdir = tempfile.mkdtemp(prefix="genttp_scrape_")
+    sink_path = os.path.join(workdir, "sink.jsonl")
+    checkpoint_path = os.path.join(workdir, "checkpoint.jsonl")
+    try:
+        # a first run that stops after two pages
+        failed = scrape(
+            [f"{base}/report1.html", f"{base}/report2.html"],
+            sink_path,
+            checkpoint_path,
+        )
+        check("first run failures", failed, [])
+
+        # the resumed run gets the whole list, finished pages are not fetched again
+        urls = [
+            f"{base}/report1.html",
+            f"{base}/report2.html",
+            f"{base}/report3.html",
+            f"{base}/flaky.html",
+            f"{base}/missing.html",
+        ]
+        failed = scrape(urls, sink_path, checkpoint_path)
+        check("resumed run failures", failed, [f"{base}/missing.html"])
+        check(
+            "requests",
+            dict(sorted(FixtureHandler.requests.items())),
+            {
+                "/flaky.html": 2,
+                "/missing.html": 1,
+                "/report1.html": 1,
+                "/report2.html": 1,
+                "/report3.html": 1,
+            },
+        )
+        errors = {
+            record["url"]: record["error"]
+            for record in read_jsonl(checkpoint_path)
+            if record["status"] == "failed"
+        }
+        check("checkpoint errors", errors, {f"{base}/missing.html": "HTTP 404"})
+
+        output_path = os.path.join(workdir, "output.csv")
+        check("exported rows", export_results(sink_path, output_path), 4)
+        print(json.dumps({"benchmark": "scrape_offline", "passed": True}))
+        return 0
+    except AssertionError as e:
+        print(f"FAILED {e}", file=sys.stderr)
+        print(json.dumps({"benchmark": "scrape_offline", "passed": False}))
+        return 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
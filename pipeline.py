@@ -0,0 +1,285 @@
+"""
+Headless unzip -> analyze -> import pipeline for batch runs, e.g. from cron:
+
+    python pipeline.py --config pipeline.json --stages unzip,analyze,import
+
+Every analysis is also recorded in the result store, from which
+--report writes an .xlsx or .csv report after the stages have run.
+
+Progress and timings are printed to stdout as one JSON object per line.
+Exit codes: 0 success, 1 a stage failed, 2 invalid configuration,
+3 finished but some items failed.
+"""
+
+import os
+
+if os.environ.get("GenTTP", False):
+    __import__("pysqlite3")
+    import sys
+
+    sys.modules["sqlite3"] = sys.modules.pop("pysqlite3")
+
+import sys
+import json
+import time
+import argparse
+
+
+EXIT_OK = 0
+EXIT_STAGE_FAILED = 1
+EXIT_CONFIG_ERROR = 2
+EXIT_PARTIAL = 3
+
+STAGES = ["unzip", "analyze", "import"]
+
+DEFAULT_CONFIG = {
+    "provider": "dashscope",
+    "model": "qwen-turbo",
+    "embedding": "text-embedding-v1",
+    "api_key": "",
+    "secret_key": "",
+    "raw_dir": "data/raw",
+    "unzip_dir": "data/unzip",
+    "analysis_dir": "data/analysis",
+    "vectorstore_path": "data/attack_vector.xlsx",
+    "analysis_cache_path": "data/analysis_cache.sqlite3",
+    # "" embeds every text again
+    "embedding_cache_path": "data/embedding_cache.sqlite3",
+    "result_store_path": "data/analysis_results.sqlite3",
+    "state_path": "data/pipeline_state.sqlite3",
+    "database_path": "data/chroma_database",
+    "collection": "",
+    "max_workers": 4,
+    "token_budget": 6000,
+    "triage_threshold": None,
+    "structured": False,
+    "dedup_threshold": None,
+    "batch_size": 32,
+    "requests_per_minute": 60,
+    "remove_deleted": False,
+    "metrics_path": "data/metrics",
+    # {"model": [prompt price, completion price]} per 1K tokens
+    "model_prices": {},
+    # route the LLM calls over several providers instead of "provider"/"model":
+    # [{"provider", "model", "api_key", "secret_key", "weight", "max_concurrency",
+    #   "requests_per_minute", "tokens_per_minute"}], keys default to the ones above
+    "routes": [],
+}
+
+
+def emit(event, **fields):
+    print(json.dumps({"event": event, "time": time.time(), **fields}), flush=True)
+
+
+def load_config(config_path):
+    config = dict(DEFAULT_CONFIG)
+    with open(config_path) as f:
+        config.update(json.load(f))
+    # keep secrets out of the config file if preferred
+    config["api_key"] = config["api_key"] or os.environ.get("GENTTP_API_KEY", "")
+    config["secret_key"] = config["secret_key"] or os.environ.get(
+        "GENTTP_SECRET_KEY", ""
+    )
+    return config
+
+
+def load_models(config):
+    from src.utils.models import create_embedding, create_llm
+
+    if config["routes"]:
+        from src.utils.router import create_router
+
+        routes = []
+        for route in config["routes"]:
+            route = dict(route)
+            provider = route.pop("provider", config["provider"])
+            model = route.pop("model", config["model"])
+            api_key = route.pop("api_key", None) or config["api_key"]
+            secret_key = route.pop("secret_key", None) or config["secret_key"]
+            route["llm"] = create_llm(provider, model, api_key, secret_key)
+            route.setdefault("name", model)
+            routes.append(route)
+        llm = create_router(routes)
+    else:
+        llm = create_llm(
+            config["provider"], config["model"], config["api_key"], config["secret_key"]
+        )
+    embedding = create_embedding(
+        config["provider"], config["embedding"], config["api_key"], config["secret_key"]
+    )
+    if config["embedding_cache_path"]:
+        from src.utils.embeddings import cached_embedding
+
+        embedding = cached_embedding(
+            embedding, config["embedding_cache_path"], config["embedding"]
+        )
+    return llm, embedding
+
+
+def run_unzip(config, models):
+    from src.agents.unzip import UnzipAgent
+
+    agent = UnzipAgent()
+    agent.load_state(config["state_path"])
+    yield from agent.invoke(config["raw_dir"], config["unzip_dir"])
+    for archive_path, error in agent.errors.items():
+        emit("item_error", stage="unzip", item=archive_path, error=error)
+    return len(agent.errors)
+
+
+def run_analyze(config, models):
+    from src.agents.analyze import AnalysisAgent
+
+    llm, embedding = models
+    agent = AnalysisAgent(llm, embedding)
+    agent.load_cache(config["analysis_cache_path"])
+    agent.load_store(config["result_store_path"])
+    agent.load_state(config["state_path"])
+    agent.load_vectorstore(config["vectorstore_path"])
+    yield from agent.invoke(
+        config["unzip_dir"],
+        config["analysis_dir"],
+        max_workers=config["max_workers"],
+        token_budget=config["token_budget"],
+        triage_threshold=config["triage_threshold"],
+        structured=config["structured"],
+        dedup_threshold=config["dedup_threshold"],
+    )
+    for folder_path, error in agent.errors.items():
+        emit("item_error", stage="analyze", item=folder_path, error=error)
+    return len(agent.errors)
+
+
+def run_import(config, models):
+    from langchain_chroma import Chroma
+    from src.utils.data import add_document, collection_manifest_path
+    from src.utils.state import PipelineState
+
+    _, embedding = models
+    collection = Chroma(
+        collection_name=config["collection"],
+        persist_directory=config["database_path"],
+        embedding_function=embedding,
+    )
+    errors = yield from add_document(
+        collection=collection,
+        embedding=embedding,
+        input_dir=config["analysis_dir"],
+        batch_size=config["batch_size"],
+        requests_per_minute=config["requests_per_minute"],
+        manifest_path=collection_manifest_path(
+            config["database_path"], config["collection"]
+        ),
+        remove_deleted=config["remove_deleted"],
+        state=PipelineState(config["state_path"]),
+    )
+    for file, error in errors.items():
+        emit("item_error", stage="import", item=file, error=error)
+    return len(errors)
+
+
+runners = {"unzip": run_unzip, "analyze": run_analyze, "import": run_import}
+
+
+def export_metrics(config):
+    from src.utils.metrics import metrics
+
+    if config["metrics_path"]:
+        metrics.export(
+            config["metrics_path"] + ".jsonl", config["metrics_path"] + ".prom"
+        )
+
+
+def run_stage(stage, config, models):
+    start = time.monotonic()
+    emit("stage_start", stage=stage)
+    runner = runners[stage](config, models)
+    done = total = 0
+    try:
+        while True:
+            done, total = next(runner)
+            emit(
+                "progress",
+                stage=stage,
+                done=done,
+                total=total,
+                elapsed=round(time.monotonic() - start, 3),
+            )
+    except StopIteration as stop:
+        failed = stop.value or 0
+    emit(
+        "stage_end",
+        stage=stage,
+        done=done,
+        total=total,
+        failed=failed,
+        elapsed=round(time.monotonic() - start, 3),
+    )
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the GenTTP pipeline headless.")
+    parser.add_argument("--config", required=True, help="JSON config file")
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        help="comma separated stages to run, in order (default: %(default)s)",
+    )
+    parser.add_argument("--report", help="write an .xlsx or .csv report when done")
+    parser.add_argument(
+        "--since",
+        type=float,
+        help="only report analyses created after this UNIX timestamp",
+    )
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    try:
+        config = load_config(args.config)
+        unknown = [stage for stage in stages if stage not in runners]
+        if unknown:
+            raise ValueError(f"Unknown stages: {', '.join(unknown)}")
+        if "import" in stages and not config["collection"]:
+            raise ValueError("The import stage needs a collection")
+        models = None
+        if set(stages) & {"analyze", "import"}:
+            if not config["api_key"]:
+                raise ValueError("No API key configured")
+            models = load_models(config)
+    except (OSError, ValueError, KeyError, ImportError) as e:
+        emit("config_error", error=str(e))
+        return EXIT_CONFIG_ERROR
+
+    from src.utils.metrics import metrics
+
+    for model, (prompt_price, completion_price) in config["model_prices"].items():
+        metrics.set_price(model, prompt_price, completion_price)
+
+    start = time.monotonic()
+    failed = 0
+    for stage in stages:
+        try:
+            failed += run_stage(stage, config, models)
+        except Exception as e:
+            emit("stage_error", stage=stage, error=f"{type(e).__name__}: {e}")
+            export_metrics(config)
+            return EXIT_STAGE_FAILED
+    export_metrics(config)
+    if args.report:
+        from src.utils.store import ResultStore
+
+        try:
+            rows = ResultStore(config["result_store_path"]).export_report(
+                args.report, since=args.since
+            )
+        except Exception as e:
+            emit("report_error", error=f"{type(e).__name__}: {e}")
+            return EXIT_STAGE_FAILED
+        emit("report", path=args.report, rows=rows)
+    emit("done", failed=failed, elapsed=round(time.monotonic() - start, 3))
+    return EXIT_PARTIAL if failed else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
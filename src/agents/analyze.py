@@ -1,10 +1,101 @@
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-from langchain_community.vectorstores import Chroma
-from langchain_core.output_parsers import StrOutputParser
+from langchain_chroma import Chroma
+from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from src.utils.cache import DiskCache, hash_file, make_key
+from src.utils.callbacks import LLMCallback
+from src.utils.dedup import cluster_packages
+from src.utils.files import (
+    chunk_files,
+    collect_files,
+    estimate_tokens,
+    format_file,
+    read_metadata,
+    source_part,
+    split_text,
+)
+from src.utils.metrics import metrics
+from src.utils.models import get_model_name
+from src.utils.state import PipelineState, hash_tree
+from src.utils.store import ResultStore
+from src.utils.triage import triage_packages
+
+DEFAULT_TOKEN_BUDGET = 6000
+# the package code is cut to this length before it is embedded as a retrieval query
+MAX_QUERY_CHARS = 2000
+# targeted follow-up requests for fields missing from a structured reply
+MAX_REPAIR_RETRIES = 2
+
+ANALYSIS_FIELDS = ["package_name", "version", "TTP", "ecosystem", "analysis_process"]
+
+ANALYSIS_SCHEMA = {
+    "title": "PackageAnalysis",
+    "description": "Security analysis of a Python package",
+    "type": "object",
+    "properties": {
+        "package_name": {"type": "string", "description": "Name of the package"},
+        "version": {"type": "string", "description": "Version of the package"},
+        "TTP": {
+            "type": "string",
+            "description": "Names of the identified attack vectors, separated by \\n",
+        },
+        "ecosystem": {"type": "string", "description": "Software ecosystem"},
+        "analysis_process": {
+            "type": "object",
+            "description": "step_1..step_4, each with description and details",
+        },
+    },
+    "required": ANALYSIS_FIELDS,
+}
+
+COMPACT_TEMPLATE = """
+Analyze the Python package below for security threats, using these attack vectors (name and description):
+{context}
+
+Package information and code:
+{file_content}
+
+Steps:
+1. Catalog the files and their execution sequence.
+2. Match PKG-INFO against the deceiving attack vectors (suspicious, unknown or uncertain information).
+3. Match the code, following its execution sequence, against the malicious attack vectors.
+4. Report the names of all identified attack vectors.
+
+Answer with only a JSON object with the keys package_name, version, TTP (attack vector names separated by \\n), ecosystem and analysis_process (step_1 to step_4, each with description and details).
+"""
+
+REPAIR_TEMPLATE = """
+A security analysis of the Python package below is missing these fields, or has invalid values for them: {missing}.
+
+Package information and code:
+{file_content}
+
+Analysis so far:
+{partial}
+
+Answer with only a JSON object containing exactly the missing fields.
+"""
+
+
+SCHEMA_TYPES = {"string": str, "object": dict}
+
+
+def missing_fields(result):
+    # absent, null or of the wrong type, e.g. TTP as a list
+    return [
+        field
+        for field in ANALYSIS_FIELDS
+        if not isinstance(result, dict)
+        or not isinstance(
+            result.get(field),
+            SCHEMA_TYPES[ANALYSIS_SCHEMA["properties"][field]["type"]],
+        )
+    ]
 
 
 def parse_json(str):
@@ -16,37 +107,50 @@ def parse_json(str):
     return json.loads(str[start : end + 1])
 
 
-def format_malicious_behaviors_from_excel(excel_path):
+def load_attack_vectors(excel_path):
     df = pd.read_excel(excel_path)
-    formatted_behaviors = ""
-    for _, row in df.iterrows():
+    texts = []
+    metadatas = []
+    for row in df[["Category", "Name", "Description"]].to_dict("records"):
         category = row["Category"]
         behavior = row["Name"]
         description = row["Description"]
-        formatted_behaviors += (
-            f"Category:{category} Name:{behavior} Description:{description} \n"
-        )
-    return formatted_behaviors
+        texts.append(f"Category:{category} Name:{behavior} Description:{description}")
+        metadatas.append({"category": str(category), "name": str(behavior)})
+    return texts, metadatas
+
+
+def format_attack_vectors(docs):
+    return "\n".join(doc.page_content for doc in docs)
 
 
 def get_file(target_path):
-    code_content = ""
-    all_files = []
-    processed_files = set()
-    for root, dirs, files in os.walk(target_path):
-        for file in files:
-            if "PKG-INFO" in file or file.endswith(".py"):
-                all_files.append((root, file))
-    all_files.sort(key=lambda x: (x[1].endswith(".py"), x[1]))
-
-    for root, file in all_files:
-        if file not in processed_files:
-            processed_files.add(file)
-            script_path = os.path.join(root, file)
-            if os.path.isfile(script_path):
-                with open(script_path, "r", encoding="utf-8") as file_content:
-                    code_content += file + ":\n" + file_content.read() + "\n"
-    return code_content
+    return "".join(
+        format_file(relpath, text) for relpath, text in collect_files(target_path)
+    )
+
+
+def result_path(folder_path, result_dir):
+    return os.path.join(result_dir, os.path.basename(folder_path) + ".json")
+
+
+def merge_results(results):
+    # reduce step for packages analyzed in several chunks
+    merged = {"package_name": "", "version": "", "TTP": "", "ecosystem": ""}
+    ttps = []
+    analysis_process = {}
+    for i, result in enumerate(results):
+        for field in ("package_name", "version", "ecosystem"):
+            if not merged[field] and result.get(field):
+                merged[field] = result[field]
+        for ttp in str(result.get("TTP", "") or "").split("\n"):
+            ttp = ttp.strip()
+            if ttp and ttp not in ttps:
+                ttps.append(ttp)
+        analysis_process[f"chunk_{i + 1}"] = result.get("analysis_process", {})
+    merged["TTP"] = "\n".join(ttps)
+    merged["analysis_process"] = analysis_process
+    return merged
 
 
 class AnalysisAgent:
@@ -119,51 +223,359 @@ Example: notice the brackets should be placed in the right place, and \\n should
 
 YOUR RESPONSE:
 """
+        self.template = template
         self.prompt = ChatPromptTemplate.from_template(template)
+        self.compact_prompt = ChatPromptTemplate.from_template(COMPACT_TEMPLATE)
+        self.repair_prompt = ChatPromptTemplate.from_template(REPAIR_TEMPLATE)
 
         self.model = llm
         self.embeddings = embedding
+        self.cache = None
+        self.store = None
+        self.state = None
+        self.hashes = {}
+        self.vectorstore_hash = ""
+        self.errors = {}
+        self.usage = {}
+
+    def load_cache(self, cache_path, max_bytes=256 * 1024 * 1024):
+        self.cache = DiskCache(cache_path, max_bytes=max_bytes)
+
+    def load_store(self, store_path):
+        self.store = ResultStore(store_path)
 
-    def load_vectorstore(self, vectorstore_path):
-        formatted_behaviors = format_malicious_behaviors_from_excel(vectorstore_path)
-        vectorstore = Chroma.from_texts(
-            {formatted_behaviors},
-            embedding=self.embeddings,
+    def load_state(self, state_path):
+        self.state = PipelineState(state_path)
+
+    def cache_key(self, file_content, structured=False):
+        return make_key(
+            file_content,
+            COMPACT_TEMPLATE if structured else self.template,
+            self.vectorstore_hash,
+            get_model_name(self.model),
+        )
+
+    def load_vectorstore(self, vectorstore_path, index_path=None, k=8):
+        """
+        Indexes every attack vector of the workbook as its own document in a persistent Chroma store.
+        The collection is named after the workbook and embedding model, so reloads reuse it without embedding.
+        """
+        self.vectorstore_hash = hash_file(vectorstore_path)
+        if index_path is None:
+            index_path = os.path.splitext(vectorstore_path)[0] + "_index"
+        collection_name = (
+            "attack_vectors_"
+            + make_key(self.vectorstore_hash, get_model_name(self.embeddings))[:16]
         )
-        retriever = vectorstore.as_retriever()
-        self.chain = (
-            {"context": retriever, "file_content": RunnablePassthrough()}
-            | self.prompt
-            | self.model
-            | StrOutputParser()
+        self.vectorstore = Chroma(
+            collection_name=collection_name,
+            persist_directory=index_path,
+            embedding_function=self.embeddings,
         )
+        if self.vectorstore._collection.count() == 0:
+            texts, metadatas = load_attack_vectors(vectorstore_path)
+            self.vectorstore.add_texts(
+                texts, metadatas=metadatas, ids=[str(i) for i in range(len(texts))]
+            )
+        retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
+        inputs = {
+            # every chunk starts with the same metadata, so the code picks the vectors
+            "context": RunnableLambda(
+                lambda content: source_part(content)[:MAX_QUERY_CHARS]
+            )
+            | retriever
+            | format_attack_vectors,
+            "file_content": RunnablePassthrough(),
+        }
+        self.chain = inputs | self.prompt | self.model | StrOutputParser()
 
-    def process_subfolder(self, subfolder_path):
+        # use the provider's tool calling / JSON mode where the model supports it
         try:
-            file_content = get_file(subfolder_path)
-            results = self.chain.invoke(file_content)
+            structured_model = self.model.with_structured_output(ANALYSIS_SCHEMA)
+            self.structured_streaming = False
+        except (NotImplementedError, AttributeError):
+            structured_model = self.model | JsonOutputParser()
+            self.structured_streaming = True
+        self.structured_chain = inputs | self.compact_prompt | structured_model
+        self.repair_chain = self.repair_prompt | self.model | JsonOutputParser()
+
+    def analyze_structured(self, file_content, callback=None):
+        """
+        Runs the compact prompt and returns the parsed reply. Plain LLMs are streamed through a
+        partial JSON parser, so a truncated or malformed reply still keeps the fields it completed;
+        only the fields that are still missing are requested again.
+        """
+        config = {"callbacks": [callback]} if callback is not None else None
+        result = {}
+        if self.structured_streaming:
+            try:
+                for partial in self.structured_chain.stream(file_content, config):
+                    if isinstance(partial, dict):
+                        result = partial
+            except ValueError:
+                pass
+        else:
+            # an unparsable tool call is repaired field by field like a truncated stream
+            try:
+                result = self.structured_chain.invoke(file_content, config)
+            except ValueError:
+                pass
+        if not isinstance(result, dict):
+            result = {}
+
+        for _ in range(MAX_REPAIR_RETRIES):
+            missing = missing_fields(result)
+            if not missing:
+                break
+            if callback is not None:
+                callback.retry()
+            try:
+                repaired = self.repair_chain.invoke(
+                    {
+                        "missing": ", ".join(missing),
+                        "file_content": file_content,
+                        "partial": json.dumps(result),
+                    },
+                    config,
+                )
+            except ValueError:
+                continue
+            if isinstance(repaired, dict):
+                result.update(
+                    {field: repaired[field] for field in missing if field in repaired}
+                )
+        return result
+
+    def process_subfolder(
+        self,
+        subfolder_path,
+        token_budget=DEFAULT_TOKEN_BUDGET,
+        triage=None,
+        structured=False,
+    ):
+        start = time.monotonic()
+        callback = LLMCallback(get_model_name(self.model), "analyze")
+        error = None
+        try:
+            if triage is not None:
+                # only the metadata and the flagged snippets are sent to the model
+                chunks = [triage["content"]]
+                if estimate_tokens(triage["content"]) > token_budget:
+                    chunks = split_text("snippets", triage["content"], token_budget)
+            else:
+                chunks = chunk_files(subfolder_path, token_budget)
+            results = self.analyze_chunks(chunks, structured, callback)
+            if not results:
+                # recorded as failed, so the next run retries it
+                raise ValueError("The model reply could not be parsed")
+            self.usage[subfolder_path] = callback
+            if triage is not None:
+                results["triage"] = {"verdict": "suspicious", "score": triage["score"]}
             return results
         except Exception as e:
-            return {subfolder_path: {"result": str(e)}}
-
-    def invoke(self, unzip_dir, result_dir):
-        os.makedirs(result_dir, exist_ok=True)
-        top_folder = unzip_dir
-        subfolders = [
-            os.path.join(top_folder, f)
-            for f in os.listdir(top_folder)
-            if os.path.isdir(os.path.join(top_folder, f))
-        ]
-        length = len(subfolders)
-        for i in range(length):
-            folder_path = subfolders[i]
-       
-            genavc_result = {}
-            result = self.process_subfolder(folder_path)
-            result = parse_json(result)
-            genavc_result.update(result)
-            folder_name = os.path.basename(folder_path)
-            json_filename = os.path.join(result_dir, f"{folder_name}.json")
-            with open(json_filename, "w") as json_file:
-                json.dump(genavc_result, json_file, indent=4)
-            yield i, length
+            error = str(e)
+            self.errors[subfolder_path] = error
+            return {subfolder_path: {"result": error}}
+        finally:
+            metrics.item(
+                "analyze",
+                subfolder_path,
+                time.monotonic() - start,
+                callback,
+                error=error,
+            )
+
+    def analyze_chunks(self, chunks, structured=False, callback=None):
+        config = {"callbacks": [callback]} if callback is not None else None
+        key = self.cache_key("".join(chunks), structured)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return json.loads(cached)
+        if structured:
+            results = [self.analyze_structured(chunk, callback) for chunk in chunks]
+        else:
+            # map over the chunks, then reduce the partial reports
+            results = [
+                parse_json(result) for result in self.chain.batch(chunks, config)
+            ]
+        # unparsable chunks add nothing; with none left the package has no result
+        results = [result for result in results if result]
+        if len(results) <= 1:
+            results = results[0] if results else {}
+        else:
+            results = merge_results(results)
+        if isinstance(results, dict) and results:
+            # with a RouterLLM, the provider(s) that answered
+            results["model"] = (
+                callback.model_name()
+                if callback is not None
+                else get_model_name(self.model)
+            )
+        if self.cache is not None and results:
+            self.cache.set(key, json.dumps(results))
+        return results
+
+    def save_result(self, folder_path, result_dir, result):
+        folder_name = os.path.basename(folder_path)
+        with open(result_path(folder_path, result_dir), "w") as json_file:
+            json.dump(result, json_file, indent=4)
+        # error placeholders and unparsable replies are not analyses
+        if self.store is not None and result.get("package_name") is not None:
+            usage = self.usage.pop(folder_path, None)
+            self.store.add(
+                result,
+                folder_path,
+                # the configured model, so a routed re-analysis replaces its row
+                get_model_name(self.model),
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                route=result.get("model"),
+            )
+        if self.state is not None:
+            self.state.finish(
+                "analyze",
+                folder_name,
+                self.hashes.get(folder_path),
+                error=self.errors.get(folder_path),
+            )
+
+    def save_cluster(self, folder_path, result_dir, result, cluster=None):
+        """
+        Saves the result of a cluster representative and a copy for every other member,
+        with the member's own package name and version. Returns the number of saved packages.
+        """
+        if not cluster or not cluster[1]:
+            self.save_result(folder_path, result_dir, result)
+            return 1
+        cluster_id, members = cluster
+        analyzed = result.get("package_name") is not None
+        if analyzed:
+            result["cluster"] = {
+                "id": cluster_id,
+                "representative": os.path.basename(folder_path),
+                "size": len(members) + 1,
+            }
+        self.save_result(folder_path, result_dir, result)
+        for member in members:
+            if not analyzed:
+                error = self.errors.get(folder_path, "Cluster representative failed")
+                self.errors[member] = error
+                self.save_result(member, result_dir, {member: {"result": error}})
+                continue
+            package_name, version = read_metadata(member)
+            copy = json.loads(json.dumps(result))
+            copy["package_name"] = package_name or os.path.basename(member)
+            copy["version"] = version
+            self.save_result(member, result_dir, copy)
+        return len(members) + 1
+
+    def triage_result(self, folder_path, triage):
+        package_name, version = read_metadata(folder_path)
+        return {
+            "package_name": package_name or os.path.basename(folder_path),
+            "version": version,
+            "TTP": "",
+            "ecosystem": "pypi",
+            "analysis_process": {},
+            "triage": {"verdict": "benign", "score": triage["score"]},
+        }
+
+    def invoke(
+        self,
+        unzip_dir,
+        result_dir,
+        max_workers=1,
+        token_budget=DEFAULT_TOKEN_BUDGET,
+        triage_threshold=None,
+        structured=False,
+        dedup_threshold=None,
+    ):
+        """
+        Analyzes every package folder in unzip_dir and writes one JSON result per package.
+        With dedup_threshold, near-duplicate packages are clustered first and only one
+        representative per cluster is sent to the model. Yields (done, total) progress.
+        """
+        with metrics.stage("analyze", unzip_dir=unzip_dir):
+            os.makedirs(result_dir, exist_ok=True)
+            self.errors = {}
+            self.usage = {}
+            top_folder = unzip_dir
+            subfolders = [
+                os.path.join(top_folder, f)
+                for f in os.listdir(top_folder)
+                if os.path.isdir(os.path.join(top_folder, f))
+            ]
+            self.hashes = {}
+            if self.state is not None:
+                self.hashes = {path: hash_tree(path) for path in subfolders}
+                pending = self.state.pending(
+                    "analyze",
+                    {os.path.basename(p): h for p, h in self.hashes.items()},
+                )
+                # packages whose result file was deleted are analyzed again too
+                subfolders = [
+                    path
+                    for path in subfolders
+                    if os.path.basename(path) in pending
+                    or not os.path.isfile(result_path(path, result_dir))
+                ]
+                self.state.start("analyze", [os.path.basename(p) for p in subfolders])
+            length = len(subfolders)
+            done = 0
+            triage = {}
+            if triage_threshold is not None:
+                triage = triage_packages(subfolders)
+                suspicious = []
+                for folder_path in subfolders:
+                    if triage[folder_path]["score"] < triage_threshold:
+                        result = self.triage_result(folder_path, triage[folder_path])
+                        self.save_result(folder_path, result_dir, result)
+                        done += 1
+                        yield done, length
+                    else:
+                        suspicious.append(folder_path)
+                subfolders = suspicious
+
+            clusters = {}
+            if dedup_threshold is not None:
+                clusters = cluster_packages(subfolders, dedup_threshold)
+                subfolders = list(clusters)
+
+            if max_workers <= 1:
+                for folder_path in subfolders:
+                    result = self.process_subfolder(
+                        folder_path, token_budget, triage.get(folder_path), structured
+                    )
+                    done += self.save_cluster(
+                        folder_path, result_dir, result, clusters.get(folder_path)
+                    )
+                    yield done, length
+                return
+
+            # LLM calls are I/O bound, so threads are enough to overlap round-trips
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self.process_subfolder,
+                        folder_path,
+                        token_budget,
+                        triage.get(folder_path),
+                        structured,
+                    ): folder_path
+                    for folder_path in subfolders
+                }
+                try:
+                    for future in as_completed(futures):
+                        folder_path = futures[future]
+                        done += self.save_cluster(
+                            folder_path,
+                            result_dir,
+                            future.result(),
+                            clusters.get(folder_path),
+                        )
+                        yield done, length
+                except GeneratorExit:
+                    # closed by a cancelled job, skip the packages not started yet
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
@@ -1,12 +1,24 @@
+import time
+from src.utils.callbacks import LLMCallback
+from src.utils.metrics import metrics
+from src.utils.models import get_model_name
+
+
 class DialogueAgent:
     def __init__(self, llm, embedding):
         self.llm = llm
         self.embedding = embedding
 
     def invoke(self, text):
-        response = self.llm(text)
+        start = time.monotonic()
+        callback = LLMCallback(get_model_name(self.llm), "dialogue")
+        response = self.llm.invoke(text, {"callbacks": [callback]})
+        metrics.item("dialogue", text, time.monotonic() - start, callback)
         return response
 
     def stream(self, text):
-        for chunk in self.llm.stream(text):
+        start = time.monotonic()
+        callback = LLMCallback(get_model_name(self.llm), "dialogue")
+        for chunk in self.llm.stream(text, {"callbacks": [callback]}):
             yield chunk
+        metrics.item("dialogue", text, time.monotonic() - start, callback)
@@ -1,13 +1,94 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
 from langchain_chroma import Chroma
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+from src.utils.callbacks import LLMCallback
+from src.utils.data import collection_manifest_path, manifest_version, ttp_key
+from src.utils.keyword import (
+    BM25Index,
+    find_phrases,
+    phrase_index,
+    reciprocal_rank_fusion,
+)
+from src.utils.metrics import metrics
+from src.utils.models import get_model_name
 
 
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
 
+def normalize_question(question):
+    return re.sub(r"\s+", " ", question.strip().lower())
+
+
+class AnswerCache:
+    """
+    AnswerCache keeps recent answers by normalized question and by question embedding,
+    so exact repeats and near-duplicate questions above the threshold are served from memory.
+    Near-duplicates must also name the same TTPs.
+    """
+
+    def __init__(self, max_entries=256, threshold=0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][1]
+        return None
+
+    def get_similar(self, embedding, ttps=()):
+        ttps = tuple(sorted(ttps))
+        with self.lock:
+            keys = [
+                key
+                for key in self.entries
+                if self.entries[key][0] is not None and self.entries[key][2] == ttps
+            ]
+            if not keys:
+                return None
+            matrix = np.array([self.entries[key][0] for key in keys])
+            query = np.asarray(embedding)
+            scores = (
+                matrix
+                @ query
+                / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+            )
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self.entries.move_to_end(keys[best])
+            return self.entries[keys[best]][1]
+
+    def set(self, question, embedding, answer, ttps=()):
+        with self.lock:
+            self.entries[normalize_question(question)] = (
+                embedding,
+                answer,
+                tuple(sorted(ttps)),
+            )
+            self.entries.move_to_end(normalize_question(question))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
 class QueryAgent:
     def __init__(self, llm, embedding):
         self.embeddings = embedding
@@ -28,6 +109,17 @@ class QueryAgent:
         """
 
         self.prompt = ChatPromptTemplate.from_template(template)
+        self.answer_cache = AnswerCache()
+        # tuples, so callers cannot mutate a cached vector
+        self.embed_query = lru_cache(maxsize=1024)(
+            lambda text: tuple(self.embeddings.embed_query(text))
+        )
+        self.collection_version = None
+        self.manifest_path = None
+        # (BM25 index, package names, TTP tag keys), swapped as a whole since the
+        # agent is shared by sessions
+        self.keywords = (BM25Index(), {}, {})
+        self.keywords_lock = threading.RLock()
 
     def load_database(self, database_path, collection_name):
         self.vectorstore = Chroma(
@@ -35,26 +127,173 @@ class QueryAgent:
             persist_directory=database_path,
             embedding_function=self.embeddings,
         )
-        self.retriever = self.vectorstore.as_retriever()
-
-    def invoke(self, question):
-        retriever = self.vectorstore.as_retriever(search_kwargs={"k": 10})
-        rag_chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
+        self.manifest_path = (
+            collection_manifest_path(database_path, collection_name)
+            if database_path
+            else None
+        )
+        self.retriever = RunnableLambda(self.retrieve)
+        self.rag_chain = (
+            {"context": self.retriever | format_docs, "question": RunnablePassthrough()}
             | self.prompt
             | self.llm
             | StrOutputParser()
         )
-        response = rag_chain.invoke(question)
+        self.invalidate_cache()
+
+    def build_keyword_index(self, page_size=1000):
+        # page through the collection so large collections are never loaded at once;
+        # built aside so concurrent retrievals keep using the previous one meanwhile
+        keyword_index = BM25Index()
+        package_names = {}
+        ttp_keys = {}
+        collection = self.vectorstore._collection
+        offset = 0
+        while True:
+            result = collection.get(
+                include=["documents", "metadatas"], limit=page_size, offset=offset
+            )
+            for doc_id, text, metadata in zip(
+                result["ids"], result["documents"], result["metadatas"]
+            ):
+                keyword_index.add(doc_id, text or "")
+                metadata = metadata or {}
+                if metadata.get("package_name"):
+                    package_names[metadata["package_name"]] = metadata["package_name"]
+                for tag in (metadata.get("TTP") or "").split("\n"):
+                    if tag:
+                        ttp_keys[tag] = ttp_key(tag)
+            if len(result["ids"]) < page_size:
+                break
+            offset += page_size
+        # names and tags are matched on whole tokens, as the question is tokenized
+        self.keywords = (
+            keyword_index,
+            phrase_index(package_names),
+            phrase_index(ttp_keys),
+        )
+
+    def mentioned_packages(self, question):
+        _, package_names, _ = self.keywords
+        return sorted(find_phrases(package_names, question))
+
+    def mentioned_ttps(self, question):
+        _, _, ttp_keys = self.keywords
+        return sorted(find_phrases(ttp_keys, question))
+
+    def get_documents(self, ids=None, where=None):
+        result = self.vectorstore._collection.get(
+            ids=ids, where=where, include=["documents", "metadatas"]
+        )
+        documents = {
+            doc_id: Document(page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(
+                result["ids"], result["documents"], result["metadatas"]
+            )
+        }
+        if ids is None:
+            return list(documents.values())
+        return [documents[doc_id] for doc_id in ids if doc_id in documents]
+
+    def retrieve(self, question, k=10):
+        """
+        Answers name-based questions with an exact metadata lookup and no embedding call;
+        otherwise fuses BM25 keyword hits with vector hits, filtered by the TTPs named in the question.
+        """
+        start = time.monotonic()
+        packages = self.mentioned_packages(question)
+        if packages:
+            documents = self.get_documents(where={"package_name": {"$in": packages}})
+            metrics.observe(
+                "retrieve_seconds", time.monotonic() - start, mode="metadata"
+            )
+            return documents[:k]
+
+        ttps = self.mentioned_ttps(question)
+        where = None
+        if len(ttps) == 1:
+            where = {ttps[0]: True}
+        elif ttps:
+            where = {"$or": [{key: True} for key in ttps]}
+        vector_hits = self.vectorstore._collection.query(
+            query_embeddings=[list(self.embed_query(question))],
+            n_results=k,
+            where=where,
+            include=[],
+        )["ids"][0]
+        keyword_index, _, _ = self.keywords
+        keyword_hits = [doc_id for doc_id, _ in keyword_index.search(question, k)]
+        documents = self.get_documents(
+            ids=reciprocal_rank_fusion([vector_hits, keyword_hits], k=k)
+        )
+        metrics.observe("retrieve_seconds", time.monotonic() - start, mode="hybrid")
+        return documents
+
+    def current_version(self):
+        # upserts keep the count, the manifest shows them; the count covers imports
+        # made without a manifest
+        return (
+            self.vectorstore._collection.count(),
+            manifest_version(self.manifest_path),
+        )
+
+    def invalidate_cache(self):
+        with self.keywords_lock:
+            self.answer_cache.clear()
+            self.collection_version = self.current_version()
+            self.build_keyword_index()
+
+    def cached_answer(self, question):
+        # the collection may have been modified by another session or the pipeline;
+        # one caller rebuilds, the others wait and then find the new version
+        with self.keywords_lock:
+            if self.current_version() != self.collection_version:
+                self.invalidate_cache()
+                return None
+        answer = self.answer_cache.get(question)
+        # questions about different packages read alike, so only match those exactly
+        if answer is None and not self.mentioned_packages(question):
+            answer = self.answer_cache.get_similar(
+                self.embed_query(question), self.mentioned_ttps(question)
+            )
+        return answer
+
+    def remember(self, question, answer):
+        embedding = None
+        if not self.mentioned_packages(question):
+            embedding = self.embed_query(question)
+        self.answer_cache.set(
+            question, embedding, answer, self.mentioned_ttps(question)
+        )
+
+    def invoke(self, question):
+        start = time.monotonic()
+        response = self.cached_answer(question)
+        if response is not None:
+            metrics.item("query", question, time.monotonic() - start, cached=True)
+            return response
+        callback = LLMCallback(get_model_name(self.llm), "query")
+        response = self.rag_chain.invoke(question, {"callbacks": [callback]})
+        self.remember(question, response)
+        metrics.item(
+            "query", question, time.monotonic() - start, callback, cached=False
+        )
         return response
 
     def stream(self, question):
-        retriever = self.vectorstore.as_retriever(search_kwargs={"k": 10})
-        rag_chain = (
-            {"context": retriever | format_docs, "question": RunnablePassthrough()}
-            | self.prompt
-            | self.llm
-            | StrOutputParser()
+        start = time.monotonic()
+        response = self.cached_answer(question)
+        if response is not None:
+            for chunk in re.split(r"(?<=\s)", response):
+                yield chunk
+            metrics.item("query", question, time.monotonic() - start, cached=True)
+            return
+        callback = LLMCallback(get_model_name(self.llm), "query")
+        chunks = []
+        for chunk in self.rag_chain.stream(question, {"callbacks": [callback]}):
+            chunks.append(chunk)
+            yield chunk
+        self.remember(question, "".join(chunks))
+        metrics.item(
+            "query", question, time.monotonic() - start, callback, cached=False
         )
-        for response in rag_chain.stream(question):
-            yield response
@@ -1,69 +1,228 @@
 import os
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.tools import ShellTool
-from langchain_core.messages import SystemMessage
+import shutil
+import time
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.utils.cache import hash_file
+from src.utils.metrics import metrics
+from src.utils.state import DONE, PipelineState
 
 
-class UnzipAgent:
+ARCHIVE_SUFFIXES = (".tar.gz", ".tar.bz2", ".tar.xz", ".tgz", ".tar", ".zip", ".whl")
+
+# zip-bomb limits, applied per archive
+MAX_MEMBERS = 20000
+MAX_TOTAL_SIZE = 1024 * 1024 * 1024
+MAX_MEMBER_SIZE = 256 * 1024 * 1024
+MAX_RATIO = 200
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def archive_stem(filename):
+    lower = filename.lower()
+    for suffix in ARCHIVE_SUFFIXES:
+        if lower.endswith(suffix):
+            return filename[: -len(suffix)]
+    return None
+
+
+def safe_member_path(dest_dir, name):
+    name = name.replace("\\", "/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":"):
+        raise ExtractionError(f"Absolute path in archive: {name}")
+    target = os.path.realpath(os.path.join(dest_dir, name))
+    root = os.path.realpath(dest_dir)
+    if target != root and not target.startswith(root + os.sep):
+        raise ExtractionError(f"Path traversal in archive: {name}")
+    return target
+
+
+class Budget:
+    def __init__(self, max_members, max_total_size, max_member_size):
+        self.max_members = max_members
+        self.max_total_size = max_total_size
+        self.max_member_size = max_member_size
+        self.members = 0
+        self.total_size = 0
+
+    def add_member(self):
+        self.members += 1
+        if self.members > self.max_members:
+            raise ExtractionError(f"Too many members (> {self.max_members})")
+
+    def copy(self, src, target, limit=None):
+        # count the bytes actually written, declared sizes can lie
+        limit = (
+            self.max_member_size if limit is None else min(limit, self.max_member_size)
+        )
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        written = 0
+        with open(target, "wb") as dst:
+            for block in iter(lambda: src.read(1 << 16), b""):
+                written += len(block)
+                self.total_size += len(block)
+                if written > limit:
+                    raise ExtractionError(f"Member exceeds size limit: {target}")
+                if self.total_size > self.max_total_size:
+                    raise ExtractionError(
+                        f"Archive exceeds size limit ({self.max_total_size} bytes)"
+                    )
+                dst.write(block)
+
+
+def extract_zip(archive_path, dest_dir, budget, max_ratio):
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            budget.add_member()
+            target = safe_member_path(dest_dir, info.filename)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            if info.compress_size and info.file_size / info.compress_size > max_ratio:
+                raise ExtractionError(f"Suspicious compression ratio: {info.filename}")
+            ratio_limit = max(info.compress_size, 1) * max_ratio
+            with archive.open(info) as src:
+                budget.copy(src, target, limit=min(info.file_size, ratio_limit))
+
+
+def extract_tar(archive_path, dest_dir, budget, max_ratio):
+    compressed_size = max(os.path.getsize(archive_path), 1)
+    # stream mode reads members sequentially without seeking or an index
+    with tarfile.open(archive_path, "r|*") as archive:
+        for member in archive:
+            budget.add_member()
+            target = safe_member_path(dest_dir, member.name)
+            if member.isdir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            if not member.isfile():
+                # links and device files are never needed for analysis
+                continue
+            src = archive.extractfile(member)
+            if src is None:
+                continue
+            budget.copy(src, target, limit=member.size)
+            if budget.total_size / compressed_size > max_ratio:
+                raise ExtractionError("Suspicious compression ratio")
+
+
+def extract_archive(
+    archive_path,
+    unzip_dir,
+    max_members=MAX_MEMBERS,
+    max_total_size=MAX_TOTAL_SIZE,
+    max_member_size=MAX_MEMBER_SIZE,
+    max_ratio=MAX_RATIO,
+    overwrite=False,
+):
     """
-    UnzipAgent is a class for unzipping all zip files at a specified path.
-    Initialize UnzipAgent with a large language model and an embedding model.
+    Extracts one archive into <unzip_dir>/<archive name without suffix>.
+    Returns (archive_path, error), where error is None on success.
     """
+    filename = os.path.basename(archive_path)
+    dest_dir = os.path.join(unzip_dir, archive_stem(filename) or filename)
+    if os.path.isdir(dest_dir) and not overwrite:
+        return archive_path, None
 
-    def __init__(self, llm, embedding):
-        self.llm = llm
-        shell_tool = ShellTool()
-        self.tools = [shell_tool]
+    partial_dir = dest_dir + ".partial"
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+    budget = Budget(max_members, max_total_size, max_member_size)
+    try:
+        if zipfile.is_zipfile(archive_path):
+            extract_zip(archive_path, partial_dir, budget, max_ratio)
+        else:
+            extract_tar(archive_path, partial_dir, budget, max_ratio)
+    except Exception as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        return archive_path, f"{type(e).__name__}: {e}"
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    os.replace(partial_dir, dest_dir)
+    return archive_path, None
 
-        unzip_prompt_template = """
-        Please decompress all the zip files from the given path: {raw_path} to {unzip_path}.
 
-        Note that:
-        1. Each extracted file should be stored in a new directory corresponding to the zip filename. This will prevent errors during future decompression of files with similar names.
-        2. All paths should be processed using UTF-8 encoding.
-        """
+def extract_timed(archive_path, unzip_dir, **limits):
+    started = time.time()
+    archive_path, error = extract_archive(archive_path, unzip_dir, **limits)
+    return archive_path, error, started
 
-        system_prompt = """
-        Please ensure that all tools and environment settings are properly set up. Follow these steps to decompress the zipfile:
-        1. Set the working directory to the given raw path.
-        2. Decompress all the zip files from the given raw directory path to the specified unzip path.
-        You can use Python scripts or shell commands to complete these tasks. If errors occur, log them and try alternative methods.
-        """
 
-        self.prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system_prompt),
-                MessagesPlaceholder("chat_history", optional=True),
-                ("human", unzip_prompt_template),
-                MessagesPlaceholder("agent_scratchpad"),
-            ]
-        )
+def list_archives(zip_dir):
+    return sorted(
+        os.path.join(zip_dir, f)
+        for f in os.listdir(zip_dir)
+        if archive_stem(f) is not None and os.path.isfile(os.path.join(zip_dir, f))
+    )
 
-        agent = create_openai_tools_agent(self.llm, self.tools, self.prompt)
-        self.agent_executor = AgentExecutor(
-            agent=agent,
-            tools=self.tools,
-            verbose=True,
-            return_intermediate_steps=True,
-            handle_parsing_errors=True,
-        )
 
-    def invoke(self, zip_dir, unzip_dir):
+class UnzipAgent:
+    """
+    UnzipAgent extracts every .zip, .whl, .tar.gz and .tgz archive at a specified path.
+    Extraction is deterministic and runs on a process pool, so no model is needed;
+    llm and embedding are accepted to keep the agent interface uniform.
+    """
+
+    def __init__(self, llm=None, embedding=None, max_workers=None):
+        self.llm = llm
+        self.max_workers = max_workers
+        self.state = None
+        self.errors = {}
+
+    def load_state(self, state_path):
+        self.state = PipelineState(state_path)
+
+    def invoke(self, zip_dir, unzip_dir, **limits):
         """
-        Invokes the UnzipAgent to decompress all zip files at the specified path.
+        Extracts all archives in zip_dir, one directory per archive in unzip_dir.
+        With a state store, only new, changed or failed archives are extracted.
+        Yields (done, total) progress; failures are collected in self.errors.
         """
         os.makedirs(unzip_dir, exist_ok=True)
-        
-
-        self.agent_executor.invoke(
-            {
-                "raw_path": zip_dir,
-                "unzip_path": unzip_dir,
-                "chat_history": [
-                    SystemMessage(
-                        content="Please ensure operations are always completed in the directories specified by the user."
-                    ),
-                ],
-            }
-        )
+        archives = list_archives(zip_dir)
+        names = {path: archive_stem(os.path.basename(path)) for path in archives}
+        self.errors = {}
+        hashes = {}
+        overwrite = set()
+        if self.state is not None:
+            hashes = {names[path]: hash_file(path) for path in archives}
+            pending = self.state.pending("unzip", hashes)
+            archives = [path for path in archives if names[path] in pending]
+            # a finished archive that is pending again has changed, replace its output;
+            # extraction is atomic, so any other existing output is complete
+            overwrite = {name for name, status in pending.items() if status == DONE}
+            self.state.start("unzip", list(pending))
+        length = len(archives)
+        if length == 0:
+            return
+
+        with metrics.stage("unzip", archives=length), ProcessPoolExecutor(
+            max_workers=self.max_workers
+        ) as executor:
+            futures = []
+            for archive_path in archives:
+                options = {"overwrite": names[archive_path] in overwrite, **limits}
+                futures.append(
+                    executor.submit(extract_timed, archive_path, unzip_dir, **options)
+                )
+            done = 0
+            try:
+                for future in as_completed(futures):
+                    archive_path, error, started = future.result()
+                    if error:
+                        self.errors[archive_path] = error
+                        metrics.inc("unzip_errors")
+                    if self.state is not None:
+                        name = names[archive_path]
+                        self.state.finish(
+                            "unzip", name, hashes[name], error=error, started=started
+                        )
+                    done += 1
+                    yield done, length
+            except GeneratorExit:
+                # closed by a cancelled job, skip the archives not started yet
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
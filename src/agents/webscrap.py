@@ -1,101 +1,361 @@
-import os
-import time
-from tqdm import tqdm
-import pandas as pd 
-
-from langchain_openai import ChatOpenAI
-from langchain.chains import create_extraction_chain
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import AsyncChromiumLoader
-from langchain_community.document_transformers import BeautifulSoupTransformer
-from langchain_core.prompts import ChatPromptTemplate
-
-
-failed_data = []
-
-llm = ChatOpenAI(temperature=0, model="gpt-4", openai_api_key="YOUR_API_KEY")
-
-schema = {
-    "properties": {
-        "malicious_package_actions": {"type": "string"},
-        "malicious_package_name": {"type": "string"},
-    },
-    "required": ["malicious_package_name", "malicious_package_actions"],
-}
-
-template = "Extract the name of the malicious pypi package present in {content} and the key description, and the output is malicious_package_name and malicious_package_actions"
-
-prompt = ChatPromptTemplate.from_template(template)
-
-
-def extract(content: str, schema: dict):
-    return create_extraction_chain(schema=schema, prompt=prompt, llm=llm).invoke(content)
-
-
-def scrape_with_playwright(urls, schema):
-    try:
-        loader = AsyncChromiumLoader(urls)
-        docs = loader.load()
-    except:
-        print('error')
-        return
-
-    if not docs:
-        print(f"{urls}, No documents loaded.")
-        return
-
-    bs_transformer = BeautifulSoupTransformer()
-    docs_transformed = bs_transformer.transform_documents(docs)
-
-    if not docs_transformed:
-        print("Document transformation failed.")
-        return
-
-    print(f"Extracting content with LLM, {urls}")
-
-    splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_overlap=0)
-    splits = splitter.split_documents(docs_transformed)
-
-    if not splits:
-        print(f"{urls}, No content available after splitting.")
-        failed_data.append(urls)
-        return
-
-    extracted_content = extract(schema=schema, content=splits[0].page_content)
-    return extracted_content["text"]
-
-
-def saved_to_excel(extracted_content, saved_path):
-    data = []
-    for item in extracted_content:
-        data.append({'url': urls[0], 'package_name': item['malicious_package_name'], 'package_action': item['malicious_package_actions']})
-
-    new_df = pd.DataFrame(data)
-
-    if os.path.isfile(saved_path):
-        with pd.ExcelWriter(saved_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            existing_df = pd.read_excel(saved_path, engine='openpyxl')
-            combined_df = pd.concat([existing_df, new_df], ignore_index=True)
-            combined_df.to_excel(writer, index=False)
-    else:
-        new_df.to_excel(saved_path, index=False)
-
-
-def main():
-    df = pd.read_excel('./report_url_unique_2.xlsx', engine='openpyxl')
-
-    for item in tqdm(df['Url'], desc='Processing URLs'):
-        urls = [item]
-        extracted_content = scrape_with_playwright(urls, schema=schema)
-        saved_path = './report_url_extract_content_0124_v5.xlsx'
-        try:
-            saved_to_excel(extracted_content, saved_path)
-        except:
-            print('error')
-        time.sleep(10)
-
-    print(failed_data)
-
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import os
+import json
+import random
+import asyncio
+import argparse
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from src.utils.sink import JsonlSink, export_table, read_jsonl
+
+schema = {
+    "properties": {
+        "malicious_package_actions": {"type": "string"},
+        "malicious_package_name": {"type": "string"},
+    },
+    "required": ["malicious_package_name", "malicious_package_actions"],
+}
+
+template = "Extract the name of the malicious pypi package present in {content} and the key description, and the output is malicious_package_name and malicious_package_actions"
+
+USER_AGENT = "Mozilla/5.0 (compatible; GenTTP report scraper)"
+
+# status codes worth retrying, anything else in 4xx fails immediately
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class HostLimiter:
+    """
+    HostLimiter caps concurrent requests per host and spaces consecutive requests
+    to the same host by at least `delay` seconds.
+    """
+
+    def __init__(self, concurrency=2, delay=1.0):
+        self.concurrency = concurrency
+        self.delay = delay
+        self.semaphores = {}
+        self.next_time = {}
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, host):
+        semaphore = self.semaphores.setdefault(
+            host, asyncio.Semaphore(self.concurrency)
+        )
+        await semaphore.acquire()
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            start = max(loop.time(), self.next_time.get(host, 0.0))
+            self.next_time[host] = start + self.delay
+        await asyncio.sleep(max(start - loop.time(), 0))
+
+    def release(self, host):
+        self.semaphores[host].release()
+
+
+class HttpFetcher:
+    """
+    HttpFetcher downloads pages with urllib on worker threads; it needs no browser.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def fetch_sync(self, url):
+        request = urllib.request.Request(url, headers={"User-Agent": USER_AGENT})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                charset = response.headers.get_content_charset() or "utf-8"
+                return response.read().decode(charset, errors="replace")
+        except urllib.error.HTTPError as e:
+            raise FetchError(f"HTTP {e.code}", retryable=e.code in RETRY_STATUS)
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise FetchError(str(e))
+
+    async def fetch(self, url):
+        return await asyncio.to_thread(self.fetch_sync, url)
+
+
+class BrowserFetcher:
+    """
+    BrowserFetcher renders pages in one shared headless Chromium, for sites that need JavaScript.
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+
+    async def __aenter__(self):
+        from playwright.async_api import async_playwright
+
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=True)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.browser.close()
+        await self.playwright.stop()
+        return False
+
+    async def fetch(self, url):
+        page = await self.browser.new_page(user_agent=USER_AGENT)
+        try:
+            response = await page.goto(url, timeout=self.timeout * 1000)
+            if response is not None and response.status >= 400:
+                raise FetchError(
+                    f"HTTP {response.status}",
+                    retryable=response.status in RETRY_STATUS,
+                )
+            return await page.content()
+        except FetchError:
+            raise
+        except Exception as e:
+            raise FetchError(str(e))
+        finally:
+            await page.close()
+
+
+class LLMExtractor:
+    """
+    LLMExtractor turns a page into [{malicious_package_name, malicious_package_actions}] with an extraction chain.
+    """
+
+    def __init__(self, llm=None):
+        from langchain.chains import create_extraction_chain
+        from langchain_core.prompts import ChatPromptTemplate
+
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+
+            llm = ChatOpenAI(
+                temperature=0,
+                model="gpt-4",
+                openai_api_key=os.environ.get("OPENAI_API_KEY", "YOUR_API_KEY"),
+            )
+        self.chain = create_extraction_chain(
+            schema=schema, prompt=ChatPromptTemplate.from_template(template), llm=llm
+        )
+
+    def first_split(self, url, html):
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_community.document_transformers import BeautifulSoupTransformer
+        from langchain_core.documents import Document
+
+        docs = BeautifulSoupTransformer().transform_documents(
+            [Document(page_content=html, metadata={"source": url})]
+        )
+        splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(chunk_overlap=0)
+        splits = splitter.split_documents(docs)
+        return splits[0].page_content if splits else ""
+
+    async def __call__(self, url, html):
+        content = await asyncio.to_thread(self.first_split, url, html)
+        if not content:
+            raise ValueError("No content available after splitting")
+        result = await self.chain.ainvoke(content)
+        return result["text"]
+
+
+class Checkpoint:
+    """
+    Checkpoint appends one JSON line per finished URL, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not self.path:
+            return set()
+        return {
+            record["url"]
+            for record in read_jsonl(self.path)
+            if record.get("status") == "done"
+        }
+
+    def mark(self, url, status, error=None):
+        if not self.path:
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"url": url, "status": status, "error": error}) + "\n")
+
+
+async def fetch_with_retries(fetcher, limiter, url, retries=3, backoff=2.0):
+    host = urllib.parse.urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        await limiter.acquire(host)
+        try:
+            return await fetcher.fetch(url)
+        except FetchError as e:
+            if not e.retryable or attempt == retries:
+                raise
+        finally:
+            limiter.release(host)
+        await asyncio.sleep(backoff * 2**attempt * (0.5 + random.random()))
+
+
+COLUMNS = ["url", "package_name", "package_action"]
+
+
+def to_rows(url, extracted_content):
+    return [
+        {
+            "url": url,
+            "package_name": item.get("malicious_package_name", ""),
+            "package_action": item.get("malicious_package_actions", ""),
+        }
+        for item in extracted_content
+    ]
+
+
+def export_results(sink_path, output_path):
+    # a crash between the sink write and the checkpoint can repeat a URL on resume
+    return export_table(
+        sink_path, output_path, columns=COLUMNS, dedupe=["url", "package_name"]
+    )
+
+
+async def run_pipeline(
+    urls,
+    fetcher,
+    extractor,
+    save,
+    checkpoint=None,
+    fetch_concurrency=8,
+    extract_concurrency=4,
+    per_host=2,
+    delay=1.0,
+    retries=3,
+    backoff=2.0,
+    progress=None,
+):
+    """
+    Fetches urls concurrently and feeds the pages to extract workers through a bounded queue,
+    so LLM extraction overlaps with fetching. save(url, items) is called from one task at a time.
+    Returns the list of URLs that failed.
+    """
+    checkpoint = checkpoint or Checkpoint(None)
+    finished = checkpoint.load()
+    pending = [url for url in dict.fromkeys(urls) if url not in finished]
+    limiter = HostLimiter(concurrency=per_host, delay=delay)
+    url_queue = asyncio.Queue()
+    page_queue = asyncio.Queue(maxsize=extract_concurrency * 2)
+    save_lock = asyncio.Lock()
+    failed = []
+    for url in pending:
+        url_queue.put_nowait(url)
+
+    def fail(url, error):
+        failed.append(url)
+        checkpoint.mark(url, "failed", error)
+        if progress:
+            progress()
+
+    async def fetch_worker():
+        while True:
+            try:
+                url = url_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                html = await fetch_with_retries(fetcher, limiter, url, retries, backoff)
+            except Exception as e:
+                fail(url, str(e))
+                continue
+            await page_queue.put((url, html))
+
+    async def extract_worker():
+        while True:
+            item = await page_queue.get()
+            if item is None:
+                return
+            url, html = item
+            try:
+                items = await extractor(url, html)
+                async with save_lock:
+                    await asyncio.to_thread(save, url, items or [])
+                checkpoint.mark(url, "done")
+                if progress:
+                    progress()
+            except Exception as e:
+                fail(url, str(e))
+
+    extractors = [
+        asyncio.create_task(extract_worker()) for _ in range(extract_concurrency)
+    ]
+    await asyncio.gather(*(fetch_worker() for _ in range(fetch_concurrency)))
+    for _ in extractors:
+        await page_queue.put(None)
+    await asyncio.gather(*extractors)
+    return failed
+
+
+async def scrape(args):
+    import pandas as pd
+    from tqdm import tqdm
+
+    df = pd.read_excel(args.input, engine="openpyxl")
+    urls = [url for url in df["Url"].dropna()]
+    fetcher = BrowserFetcher() if args.browser else HttpFetcher()
+    extractor = LLMExtractor()
+    sink = JsonlSink(args.sink)
+    with sink, tqdm(total=len(urls), desc="Processing URLs") as bar:
+        async with fetcher:
+            return await run_pipeline(
+                urls,
+                fetcher,
+                extractor,
+                save=lambda url, items: sink.write_many(to_rows(url, items)),
+                checkpoint=Checkpoint(args.checkpoint),
+                fetch_concurrency=args.fetch_concurrency,
+                extract_concurrency=args.extract_concurrency,
+                per_host=args.per_host,
+                delay=args.delay,
+                progress=lambda: bar.update(1),
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract malicious packages from report URLs."
+    )
+    parser.add_argument("--input", default="./report_url_unique_2.xlsx")
+    parser.add_argument("--output", default="./report_url_extract_content_0124_v5.xlsx")
+    parser.add_argument("--sink", default="./report_url_extract_content.jsonl")
+    parser.add_argument("--checkpoint", default="./report_url_checkpoint.jsonl")
+    parser.add_argument(
+        "--export-only",
+        action="store_true",
+        help="only compact the sink into the output workbook",
+    )
+    parser.add_argument(
+        "--browser", action="store_true", help="render pages with Chromium"
+    )
+    parser.add_argument("--fetch-concurrency", type=int, default=8)
+    parser.add_argument("--extract-concurrency", type=int, default=4)
+    parser.add_argument("--per-host", type=int, default=2)
+    parser.add_argument(
+        "--delay", type=float, default=1.0, help="seconds between requests to one host"
+    )
+    args = parser.parse_args(argv)
+
+    if not args.export_only:
+        failed_data = asyncio.run(scrape(args))
+        print(failed_data)
+    rows = export_results(args.sink, args.output)
+    print(f"Exported {rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
+import os
+import uuid
+import hashlib
+import importlib
+import threading
 import streamlit as st
-from src.agents.dialogue import DialogueAgent
-from src.agents.query import QueryAgent
-from src.agents.unzip import UnzipAgent
-from src.agents.analyze import AnalysisAgent
+from src.utils.models import create_embedding, create_llm
+from src.utils.registry import SharedRegistry
 import logging
 
 
@@ -21,22 +24,18 @@ class Dashscope:
             st.session_state.api_key = api_key
             model_name = st.selectbox("Model Name", self.model_names, index=0)
             if st.button("Load LLM") and api_key != "":
-                from langchain_community.llms import tongyi
-
                 Provider.register_llm(
-                    tongyi.Tongyi(dashscope_api_key=api_key, model_name=model_name),
+                    create_llm("dashscope", model_name, api_key),
                     model_name,
+                    fingerprint=Provider.fingerprint(api_key),
                 )
 
             embedding_name = st.selectbox("Embedding Name", self.embedding_names)
             if st.button("Load embedding") and api_key != "":
-                from langchain_community.embeddings import DashScopeEmbeddings
-
                 Provider.register_embedding(
-                    DashScopeEmbeddings(
-                        dashscope_api_key=api_key, model=embedding_name
-                    ),
+                    create_embedding("dashscope", embedding_name, api_key),
                     embedding_name,
+                    fingerprint=Provider.fingerprint(api_key),
                 )
 
 
@@ -59,24 +58,18 @@ class Qianfan:
             st.session_state.secret_key = secret_key
             model_name = st.selectbox("Model Name", self.model_names)
             if st.button("Load LLM") and api_key != "" and secret_key != "":
-                from langchain_community.llms import baidu_qianfan_endpoint
-
                 Provider.register_llm(
-                    baidu_qianfan_endpoint.QianfanLLMEndpoint(
-                        model=model_name, qianfan_ak=api_key, qianfan_sk=secret_key
-                    ),
+                    create_llm("qianfan", model_name, api_key, secret_key),
                     model_name,
+                    fingerprint=Provider.fingerprint(api_key, secret_key),
                 )
 
             embedding_name = st.selectbox("Embedding Name", self.embedding_names)
             if st.button("Load embedding") and api_key != "" and secret_key != "":
-                from langchain_community.embeddings import baidu_qianfan_endpoint
-
                 Provider.register_embedding(
-                    baidu_qianfan_endpoint.QianfanEmbeddingsEndpoint(
-                        model=embedding_name, qianfan_ak=api_key, qianfan_sk=secret_key
-                    ),
+                    create_embedding("qianfan", embedding_name, api_key, secret_key),
                     embedding_name,
+                    fingerprint=Provider.fingerprint(api_key, secret_key),
                 )
 
 
@@ -100,28 +93,18 @@ class Volcano:
             st.session_state.secret_key = secret_key
             model_name = st.selectbox("Model Name", self.model_names)
             if st.button("Load LLM") and api_key != "" and secret_key != "":
-                from langchain_community.llms import volcengine_maas
-
                 Provider.register_llm(
-                    volcengine_maas.VolcEngineMaasLLM(
-                        model=model_name,
-                        volc_engine_maas_ak=api_key,
-                        volc_engine_maas_sk=secret_key,
-                    ),
+                    create_llm("volcano", model_name, api_key, secret_key),
                     model_name,
+                    fingerprint=Provider.fingerprint(api_key, secret_key),
                 )
 
             embedding_name = st.selectbox("Embedding Name", self.embedding_names)
             if st.button("Load embedding") and api_key != "" and secret_key != "":
-                from langchain_community.embeddings import volcengine
-
                 Provider.register_embedding(
-                    volcengine.VolcanoEmbeddings(
-                        model=embedding_name,
-                        volcano_ak=api_key,
-                        volcano_sk=secret_key,
-                    ),
+                    create_embedding("volcano", embedding_name, api_key, secret_key),
                     embedding_name,
+                    fingerprint=Provider.fingerprint(api_key, secret_key),
                 )
 
 
@@ -140,29 +123,65 @@ class OpenAI:
             st.session_state.api_key = api_key
             model_name = st.selectbox("Model Name", self.model_names)
             if st.button("Load LLM") and api_key != "":
-                from langchain_openai import ChatOpenAI
-
                 Provider.register_llm(
-                    ChatOpenAI(
-                        openai_api_key=api_key,
-                        model_name=model_name,
-                        base_url="https://api.openai-hub.com/v1",
-                    ),
+                    create_llm("openai", model_name, api_key),
                     model_name,
+                    fingerprint=Provider.fingerprint(api_key),
                 )
 
             embedding_name = st.selectbox("Embedding Name", self.embedding_names)
             if st.button("Load embedding") and api_key != "":
-                from langchain_openai import OpenAIEmbeddings
-
                 Provider.register_embedding(
-                    OpenAIEmbeddings(
-                        openai_api_key=api_key,
-                        model=embedding_name,
-                        base_url="https://api.openai-hub.com/v1",
-                    ),
+                    create_embedding("openai", embedding_name, api_key),
                     embedding_name,
+                    fingerprint=Provider.fingerprint(api_key),
+                )
+
+
+class Router:
+    def config_ui(self):
+        with st.container(border=True):
+            st.subheader("Router")
+            st.write(
+                "Spreads calls over the LLMs loaded in the other providers and "
+                "fails over on rate limits and timeouts."
+            )
+            loaded = [
+                name
+                for name in st.session_state.get("loaded_llms", {})
+                if not name.startswith("router:")
+            ]
+            names = st.multiselect("Models", loaded)
+            routes = []
+            for name in names:
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    weight = st.number_input(
+                        f"{name} Weight", min_value=0.1, value=1.0, key=f"{name}_weight"
+                    )
+                with col2:
+                    max_concurrency = st.number_input(
+                        "Concurrency", min_value=1, value=4, key=f"{name}_concurrency"
+                    )
+                with col3:
+                    requests_per_minute = st.number_input(
+                        "RPM (0: no limit)", min_value=0, value=0, key=f"{name}_rpm"
+                    )
+                with col4:
+                    tokens_per_minute = st.number_input(
+                        "TPM (0: no limit)", min_value=0, value=0, key=f"{name}_tpm"
+                    )
+                routes.append(
+                    {
+                        "name": name,
+                        "weight": float(weight),
+                        "max_concurrency": int(max_concurrency),
+                        "requests_per_minute": int(requests_per_minute) or None,
+                        "tokens_per_minute": int(tokens_per_minute) or None,
+                    }
                 )
+            if st.button("Load LLM") and routes:
+                Provider.register_router(routes)
 
 
 llms = {
@@ -170,21 +189,105 @@ llms = {
     "qianfan": Qianfan,
     "volcano": Volcano,
     "openai": OpenAI,
+    "router": Router,
 }
 
 llms_list = list(llms.keys())
 
-dialogue_agents = {"dialogue": DialogueAgent, "query": QueryAgent}
+# agent classes are imported on first use, they pull in langchain, pandas and chromadb
+dialogue_agents = {
+    "dialogue": "src.agents.dialogue:DialogueAgent",
+    "query": "src.agents.query:QueryAgent",
+}
 
 util_agents = {
-    "unzip": UnzipAgent,
-    "analyze": AnalysisAgent,
+    "unzip": "src.agents.unzip:UnzipAgent",
+    "analyze": "src.agents.analyze:AnalysisAgent",
 }
 
 agents = {**dialogue_agents, **util_agents}
 
 
+def resolve_agent(agent_name):
+    module_name, _, class_name = agents[agent_name].partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# process-wide, so every browser session reuses the same clients and agents
+shared_resources = SharedRegistry()
+
+
 class Provider:
+    @staticmethod
+    def session_id():
+        return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+    @staticmethod
+    def fingerprint(*secrets):
+        return hashlib.sha256("\0".join(secrets).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def acquire_shared(slot, key, factory):
+        # keep one shared key per session slot and release the one it replaces
+        keys = st.session_state.setdefault("shared_keys", {})
+        if keys.get(slot) not in (None, key):
+            shared_resources.release(keys[slot], Provider.session_id())
+        keys[slot] = key
+        return shared_resources.acquire(key, Provider.session_id(), factory)
+
+    @staticmethod
+    def release_shared(slot):
+        keys = st.session_state.setdefault("shared_keys", {})
+        if keys.get(slot) is not None:
+            shared_resources.release(keys.pop(slot), Provider.session_id())
+
+    @staticmethod
+    def prewarm():
+        """
+        Warms up, in a background thread, whatever this session will need next:
+        the agent modules, the Chroma client and the embedding connection.
+        Each item is warmed once per session.
+        """
+        warmed = st.session_state.setdefault("prewarmed", set())
+        holder = Provider.session_id()
+        tasks = []
+        if "agents" not in warmed:
+            warmed.add("agents")
+            tasks.extend(lambda name=name: resolve_agent(name) for name in agents)
+        database_path = st.session_state.get("database_path", None)
+        if database_path and ("database", database_path) not in warmed:
+            warmed.add(("database", database_path))
+
+            def warm_database():
+                from chromadb import PersistentClient
+
+                shared_resources.acquire(
+                    ("database", os.path.realpath(database_path)),
+                    holder,
+                    lambda: PersistentClient(path=database_path),
+                )
+
+            tasks.append(warm_database)
+        embedding, embedding_name = Provider.get_current_embedding()
+        if embedding is not None and ("embedding", embedding_name) not in warmed:
+            warmed.add(("embedding", embedding_name))
+            # past the cache, which would answer without opening a connection
+            tasks.append(
+                lambda: getattr(embedding, "embeddings", embedding).embed_query(
+                    "warmup"
+                )
+            )
+
+        def run():
+            for task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    logging.warning(f"Prewarm failed: {e}")
+
+        if tasks:
+            threading.Thread(target=run, daemon=True).start()
+
     @staticmethod
     def get_database():
         return st.session_state.get("database_client", None)
@@ -194,7 +297,11 @@ class Provider:
         from chromadb import PersistentClient
 
         st.session_state.database_path = database_path
-        st.session_state.database_client = PersistentClient(path=database_path)
+        st.session_state.database_client = Provider.acquire_shared(
+            "database",
+            ("database", os.path.realpath(database_path)),
+            lambda: PersistentClient(path=database_path),
+        )
         logging.info(f"Initialized database client")
 
     @staticmethod
@@ -222,18 +329,63 @@ class Provider:
         return llms[llm_name]()
 
     @staticmethod
-    def register_llm(llm, name):
+    def register_llm(llm, name, fingerprint=""):
         st.session_state.llm = {}
-        st.session_state.llm["instance"] = llm
+        st.session_state.llm["instance"] = Provider.acquire_shared(
+            "llm", ("llm", type(llm).__name__, name, fingerprint), lambda: llm
+        )
         st.session_state.llm["name"] = name
-        st.session_state.agent = None
+        st.session_state.llm["fingerprint"] = fingerprint
+        # kept, so the router can combine the models loaded in this session
+        st.session_state.setdefault("loaded_llms", {})[name] = {
+            "instance": st.session_state.llm["instance"],
+            "fingerprint": fingerprint,
+        }
+        Provider.reset_agents()
 
     @staticmethod
-    def register_embedding(embedding, name):
+    def register_router(routes):
+        """
+        Registers a RouterLLM over loaded LLMs; routes are dicts with the name of a
+        loaded LLM and its weight, max_concurrency and per-minute limits.
+        """
+        from src.utils.router import create_router
+
+        loaded = st.session_state.get("loaded_llms", {})
+        Provider.register_llm(
+            create_router(
+                [
+                    {**route, "llm": loaded[route["name"]]["instance"]}
+                    for route in routes
+                ]
+            ),
+            "router:" + "+".join(route["name"] for route in routes),
+            # same models and limits share one router, and so its rate limits
+            fingerprint=Provider.fingerprint(
+                *(
+                    loaded[route["name"]]["fingerprint"] + repr(sorted(route.items()))
+                    for route in routes
+                )
+            ),
+        )
+
+    @staticmethod
+    def register_embedding(embedding, name, fingerprint=""):
+        from src.utils.embeddings import cached_embedding
+
         st.session_state.embedding = {}
-        st.session_state.embedding["instance"] = embedding
+        # vectors are kept on disk, so reloads and rebuilds only embed new texts
+        cache_path = st.session_state.get(
+            "embedding_cache_path", "./data/embedding_cache.sqlite3"
+        )
+        st.session_state.embedding["instance"] = Provider.acquire_shared(
+            "embedding",
+            ("embedding", type(embedding).__name__, name, fingerprint, cache_path),
+            lambda: cached_embedding(embedding, cache_path, name),
+        )
         st.session_state.embedding["name"] = name
-        st.session_state.agent = None
+        st.session_state.embedding["fingerprint"] = fingerprint
+        Provider.reset_agents()
 
     @staticmethod
     def get_current_llm():
@@ -247,10 +399,25 @@ class Provider:
             "name", None
         )
 
+    @staticmethod
+    def reset_agents():
+        for agent_name in st.session_state.get("agent", None) or {}:
+            Provider.release_shared(f"agent:{agent_name}")
+        st.session_state.agent = None
+
     @staticmethod
     def get_agent(agent_name):
         if st.session_state.get("agent", None) is None:
             return None
+        key = st.session_state.get("shared_keys", {}).get(f"agent:{agent_name}")
+        if (
+            key is not None
+            and shared_resources.touch(key, Provider.session_id()) is None
+        ):
+            # evicted while this session was idle; drop the stale key once
+            st.session_state.agent.pop(agent_name, None)
+            Provider.release_shared(f"agent:{agent_name}")
+            return None
         return st.session_state.agent.get(agent_name, None)
 
     @staticmethod
@@ -260,25 +427,71 @@ class Provider:
         st.session_state.agent[agent_name] = agent
         logging.info(f"Registered agent {agent_name}")
 
+    @staticmethod
+    def agent_key(agent_name):
+        llm = st.session_state.get("llm", {})
+        embedding = st.session_state.get("embedding", {})
+        database_path = st.session_state.get("database_path", None)
+        return (
+            "agent",
+            agent_name,
+            llm.get("name", None),
+            llm.get("fingerprint", ""),
+            embedding.get("name", None),
+            embedding.get("fingerprint", ""),
+            os.path.realpath(database_path) if database_path else None,
+            Provider.get_current_collection()[1],
+            st.session_state.get("vectorstore_path", "./data/attack_vector.xlsx"),
+        )
+
+    @staticmethod
+    def create_agent(agent_name, llm, embedding):
+        agent = resolve_agent(agent_name)(llm, embedding)
+        if hasattr(agent, "load_database"):
+            agent.load_database(
+                st.session_state.get("database_path", None),
+                Provider.get_current_collection()[1],
+            )
+        if hasattr(agent, "load_cache"):
+            agent.load_cache(
+                st.session_state.get(
+                    "analysis_cache_path", "./data/analysis_cache.sqlite3"
+                )
+            )
+        if hasattr(agent, "load_store"):
+            agent.load_store(
+                st.session_state.get(
+                    "result_store_path", "./data/analysis_results.sqlite3"
+                )
+            )
+        if hasattr(agent, "load_state"):
+            agent.load_state(
+                st.session_state.get(
+                    "pipeline_state_path", "./data/pipeline_state.sqlite3"
+                )
+            )
+        if hasattr(agent, "load_vectorstore"):
+            agent.load_vectorstore(
+                st.session_state.get("vectorstore_path", "./data/attack_vector.xlsx")
+            )
+        return agent
+
     @staticmethod
     def init_agent(agent_name):
         llm = st.session_state.get("llm", {}).get("instance", None)
         embedding = st.session_state.get("embedding", {}).get("instance", None)
         if llm and embedding:
             try:
-                agent = agents[agent_name](llm, embedding)
-                if hasattr(agent, "load_database"):
+                if hasattr(resolve_agent(agent_name), "load_database"):
                     collection = Provider.get_current_collection()[1]
                     database_path = st.session_state.get("database_path", None)
                     if not collection or not database_path:
                         return None
-                    agent.load_database(database_path, collection)
-                if hasattr(agent, "load_vectorstore"):
-                    agent.load_vectorstore(
-                        st.session_state.get(
-                            "vectorstore_path", "./data/attack_vector.xlsx"
-                        )
-                    )
+                agent = Provider.acquire_shared(
+                    f"agent:{agent_name}",
+                    Provider.agent_key(agent_name),
+                    lambda: Provider.create_agent(agent_name, llm, embedding),
+                )
                 Provider.register_agent(agent_name, agent)
             except Exception as e:
                 st.error(f"Failed to initialize agent: {e}")
@@ -0,0 +1,130 @@
+import time
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from src.utils.metrics import metrics
+
+
+def llm_usage(response):
+    # OpenAI-style providers report usage in llm_output, chat models on each message
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            metadata = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens += metadata.get("input_tokens", 0)
+            completion_tokens += metadata.get("output_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+def llm_route(response):
+    # the provider a RouterLLM sent the call to, None for plain models
+    route = (response.llm_output or {}).get("route")
+    if route:
+        return route
+    for generations in response.generations:
+        for generation in generations:
+            route = (generation.generation_info or {}).get("route")
+            if route:
+                return route
+    return None
+
+
+class LLMCallback(BaseCallbackHandler):
+    """
+    LLMCallback times every LLM call it is attached to and reports latency,
+    time to first token, tokens, cost, errors and retries to `metrics`.
+    It also keeps the totals for the package or query it was created for, and the
+    providers that answered when the model is a RouterLLM.
+    """
+
+    def __init__(self, model, stage):
+        self.model = model
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.started = {}
+        self.first_token = set()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.ttft = None
+        self.retries = 0
+        self.errors = 0
+        self.models = set()
+        self.cost = None
+
+    def on_llm_start(self, serialized, prompts, run_id, **kwargs):
+        self.started[run_id] = time.monotonic()
+
+    def on_chat_model_start(self, serialized, messages, run_id, **kwargs):
+        self.started[run_id] = time.monotonic()
+
+    def on_llm_new_token(self, token, run_id, **kwargs):
+        if run_id in self.first_token or run_id not in self.started:
+            return
+        self.first_token.add(run_id)
+        ttft = time.monotonic() - self.started[run_id]
+        metrics.observe("llm_ttft_seconds", ttft, model=self.model)
+        with self.lock:
+            if self.ttft is None:
+                self.ttft = ttft
+
+    def on_llm_end(self, response, run_id, **kwargs):
+        latency = time.monotonic() - self.started.pop(run_id, time.monotonic())
+        self.first_token.discard(run_id)
+        prompt_tokens, completion_tokens = llm_usage(response)
+        model = llm_route(response) or self.model
+        metrics.observe("llm_latency_seconds", latency, model=model)
+        metrics.inc("llm_calls", model=model, stage=self.stage)
+        metrics.inc("llm_prompt_tokens", prompt_tokens, model=model)
+        metrics.inc("llm_completion_tokens", completion_tokens, model=model)
+        cost = metrics.cost(model, prompt_tokens, completion_tokens)
+        if cost is not None:
+            metrics.inc("llm_cost", cost, model=model)
+        with self.lock:
+            self.models.add(model)
+            if cost is not None:
+                self.cost = (self.cost or 0.0) + cost
+            self.calls += 1
+            self.latency += latency
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def on_llm_error(self, error, run_id, **kwargs):
+        self.started.pop(run_id, None)
+        self.first_token.discard(run_id)
+        metrics.inc("llm_errors", model=self.model, stage=self.stage)
+        with self.lock:
+            self.errors += 1
+
+    def on_retry(self, retry_state, **kwargs):
+        self.retry()
+
+    def retry(self):
+        # also called by the agents for their own follow-up requests
+        metrics.inc("llm_retries", model=self.model, stage=self.stage)
+        with self.lock:
+            self.retries += 1
+
+    def model_name(self):
+        # the model(s) that produced the answer
+        with self.lock:
+            return "+".join(sorted(self.models)) or self.model
+
+    def summary(self):
+        with self.lock:
+            return {
+                "model": self.model,
+                "models": sorted(self.models),
+                "llm_calls": self.calls,
+                "llm_seconds": round(self.latency, 3),
+                "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cost": self.cost,
+                "retries": self.retries,
+                "errors": self.errors,
+            }
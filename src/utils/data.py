@@ -1,38 +1,320 @@
 import os
+import re
 import json
 import time
+import random
+import hashlib
+import logging
 from langchain_core.documents import Document
+from src.utils.cache import hash_file
+from src.utils.metrics import metrics
+from src.utils.ratelimit import RateLimiter
 
 
-def add_document(collection, embedding, input_dir):
-    files = os.listdir(input_dir)
+def document_id(file):
+    # deterministic, so re-importing a file overwrites its previous vector
+    return hashlib.sha1(file.encode("utf-8")).hexdigest()
+
+
+def split_ttp(ttp):
+    if isinstance(ttp, list):
+        tags = ttp
+    else:
+        tags = re.split(r"\n|,|;|→", str(ttp or ""))
+    return [str(tag).strip().lower() for tag in tags if str(tag).strip()]
+
+
+def ttp_key(tag):
+    return "ttp_" + re.sub(r"\W+", "_", tag).strip("_")
+
+
+def document_metadata(package_name, version, ecosystem, ttp):
+    # Chroma metadata values must be scalars, so each TTP tag becomes a boolean flag
+    metadata = {
+        "package_name": str(package_name or "").lower(),
+        "version": str(version or ""),
+        "ecosystem": str(ecosystem or "").lower(),
+        "TTP": "\n".join(split_ttp(ttp)),
+    }
+    for tag in split_ttp(ttp):
+        metadata[ttp_key(tag)] = True
+    return metadata
+
+
+def load_document(file_path):
+    with open(file_path) as f:
+        data = json.load(f)
+
+    package_name = data.get("package_name", "")
+    version = data.get("version", "")
+    ttp = data.get("TTP", "")
+    ecosystem = data.get("ecosystem", "")
+    analysis_process = data.get("analysis_process", {})
+
+    document_content = {
+        "package_name": package_name,
+        "version": version,
+        "TTP": ttp,
+        "ecosystem": ecosystem,
+        "analysis_process": analysis_process,
+    }
+
+    return Document(
+        page_content=json.dumps(document_content),
+        metadata=document_metadata(package_name, version, ecosystem, ttp),
+    )
+
+
+def collection_manifest_path(database_path, collection_name):
+    return os.path.join(database_path, f"{collection_name}_manifest.json")
+
+
+def manifest_version(manifest_path):
+    # add_document rewrites the manifest on every upsert and delete, so its stat
+    # tells readers in other sessions and processes that the collection changed
+    try:
+        stat = os.stat(manifest_path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_manifest(manifest_path):
+    if manifest_path and os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest_path, manifest):
+    if not manifest_path:
+        return
+    if os.path.dirname(manifest_path):
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def changed_files(input_dir, files, manifest):
+    """
+    Returns the files that are new or whose content changed since they were imported,
+    with their current manifest entries. Size and mtime are compared before hashing.
+    """
+    changed = {}
+    for file in files:
+        file_path = os.path.join(input_dir, file)
+        stat = os.stat(file_path)
+        entry = manifest.get(file)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+        content_hash = hash_file(file_path)
+        if entry and entry["hash"] == content_hash:
+            entry["mtime"] = stat.st_mtime
+            continue
+        changed[file] = {
+            "id": document_id(file),
+            "hash": content_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+    return changed
+
+
+def write_documents(collection, documents, ids, embeddings):
+    # write the precomputed vectors straight to the underlying Chroma collection,
+    # Chroma.add_documents would embed the texts a second time
+    metadatas = [document.metadata for document in documents]
+    collection._collection.upsert(
+        ids=ids,
+        embeddings=embeddings,
+        documents=[document.page_content for document in documents],
+        metadatas=metadatas if all(metadatas) else None,
+    )
+
+
+def embed_and_write(
+    collection, embedding, documents, ids, limiter=None, retries=3, backoff=2.0
+):
+    # a transient 429/5xx of the provider or the store only costs a retry of the batch
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            embed_start = time.monotonic()
+            embeddings = embedding.embed_documents(
+                [document.page_content for document in documents]
+            )
+            write_start = time.monotonic()
+            write_documents(collection, documents, ids, embeddings)
+            metrics.observe("embedding_seconds", write_start - embed_start)
+            metrics.observe("write_seconds", time.monotonic() - write_start)
+            return
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt * (0.5 + random.random())
+            logging.warning(f"Batch failed, retrying in {delay:.1f}s: {e}")
+            metrics.inc("import_retries")
+            time.sleep(delay)
+
+
+def add_document(
+    collection,
+    embedding,
+    input_dir,
+    batch_size=32,
+    requests_per_minute=60,
+    manifest_path=None,
+    remove_deleted=False,
+    state=None,
+    retries=3,
+    backoff=2.0,
+):
+    """
+    Imports the analysis JSON files in input_dir and yields (done, total) progress.
+    Returns {file: error} for the files that could not be read or written; a batch is
+    retried with backoff before its files are given up until the next import.
+    With a manifest_path, unchanged files are skipped and changed ones upserted;
+    remove_deleted also drops the documents of files no longer in input_dir.
+    A PipelineState, if given, records the outcome of every file.
+    """
+    files = sorted(file for file in os.listdir(input_dir) if file.endswith(".json"))
+    manifest = load_manifest(manifest_path)
+
+    present = set(files)
+    deleted = [file for file in manifest if file not in present]
+    if remove_deleted and deleted:
+        collection._collection.delete(ids=[manifest[file]["id"] for file in deleted])
+        for file in deleted:
+            del manifest[file]
+        logging.info(f"Removed: {', '.join(deleted)}")
+
+    pending = changed_files(input_dir, files, manifest)
+    save_manifest(manifest_path, manifest)
+    files = sorted(pending)
     lenght = len(files)
-    for i in range(lenght):
-        file = files[i]
-        if file.endswith(".json"):
-            file_path = os.path.join(input_dir, file)
-            with open(file_path) as f:
-                data = json.load(f)
-
-            package_name = data.get("package_name", "")
-            version = data.get("version", "")
-            ttp = data.get("TTP", "")
-            ecosystem = data.get("ecosystem", "")
-            analysis_process = data.get("analysis_process", {})
-
-            document_content = {
-                "package_name": package_name,
-                "version": version,
-                "TTP": ttp,
-                "ecosystem": ecosystem,
-                "analysis_process": analysis_process,
-            }
-
-            document = Document(page_content=json.dumps(document_content))
-
-            embeddings = embedding.embed_documents(document.page_content)
-
-            collection.add_documents(documents=[document], embeddings=[embeddings])
-            print("Done: ", file)
-            yield i, lenght
-            time.sleep(5)  # To avoid rate limiting
+    errors = {}
+    limiter = RateLimiter(requests_per_minute) if requests_per_minute else None
+    if state is not None:
+        state.start("import", [os.path.splitext(file)[0] for file in files])
+    with metrics.stage("import", documents=lenght):
+        for start in range(0, lenght, batch_size):
+            batch = files[start : start + batch_size]
+            documents = []
+            ids = []
+            for file in batch:
+                try:
+                    documents.append(load_document(os.path.join(input_dir, file)))
+                    ids.append(pending[file]["id"])
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipped: {file} {e}")
+                    errors[file] = str(e)
+                    metrics.inc("import_errors")
+                    if state is not None:
+                        state.finish("import", os.path.splitext(file)[0], error=str(e))
+
+            if documents:
+                try:
+                    embed_and_write(
+                        collection, embedding, documents, ids, limiter, retries, backoff
+                    )
+                except Exception as e:
+                    # left out of the manifest, so the next import tries them again
+                    for file in batch:
+                        if pending[file]["id"] in ids:
+                            logging.warning(f"Failed: {file} {e}")
+                            errors[file] = str(e)
+                            metrics.inc("import_errors")
+                            if state is not None:
+                                state.finish(
+                                    "import", os.path.splitext(file)[0], error=str(e)
+                                )
+                    yield start + len(batch), lenght
+                    continue
+                metrics.inc("imported_documents", len(documents))
+                for file in batch:
+                    if pending[file]["id"] in ids:
+                        manifest[file] = pending[file]
+                        if state is not None:
+                            state.finish(
+                                "import",
+                                os.path.splitext(file)[0],
+                                pending[file]["hash"],
+                            )
+                save_manifest(manifest_path, manifest)
+                logging.info(f"Done: {', '.join(batch)}")
+            yield start + len(batch), lenght
+    return errors
+
+
+def parse_where(text):
+    """
+    Parses "key=value, key2=value2" into a Chroma metadata filter, or None when empty.
+    """
+    clauses = []
+    for part in text.split(","):
+        key, sep, value = part.partition("=")
+        key, value = key.strip(), value.strip()
+        if not sep or not key:
+            continue
+        if value.lower() in ("true", "false"):
+            value = value.lower() == "true"
+        clauses.append({key: value})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def inspect_page(
+    collection,
+    limit=50,
+    offset=0,
+    where=None,
+    contains=None,
+    preview_chars=300,
+    embeddings=False,
+):
+    """
+    Returns (rows, total) for one page of a raw Chroma collection. Filtering and paging
+    happen in Chroma; documents are cut to preview_chars and embeddings are reduced
+    to their dimension and norm.
+    """
+    where_document = {"$contains": contains} if contains else None
+    if where is None and where_document is None:
+        total = collection.count()
+    else:
+        # ids only, to count the matches without loading their payload
+        total = len(
+            collection.get(where=where, where_document=where_document, include=[])[
+                "ids"
+            ]
+        )
+    include = ["documents", "metadatas"] + (["embeddings"] if embeddings else [])
+    result = collection.get(
+        where=where,
+        where_document=where_document,
+        limit=limit,
+        offset=offset,
+        include=include,
+    )
+    rows = []
+    for i, doc_id in enumerate(result["ids"]):
+        document = result["documents"][i] or ""
+        row = {
+            "id": doc_id,
+            "document": (
+                document[:preview_chars] + "…"
+                if preview_chars and len(document) > preview_chars
+                else document
+            ),
+            "length": len(document),
+            "metadata": json.dumps(result["metadatas"][i] or {}, ensure_ascii=False),
+        }
+        if embeddings and result.get("embeddings") is not None:
+            vector = result["embeddings"][i]
+            row["dimension"] = len(vector)
+            row["norm"] = round(sum(x * x for x in vector) ** 0.5, 4)
+        rows.append(row)
+    return rows, total
@@ -0,0 +1,137 @@
+import os
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from src.utils.files import METADATA_FILES, collect_files, read_metadata
+from src.utils.keyword import tokenize
+
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+# 16 bands of 8 rows make pairs above ~0.7 Jaccard likely candidates
+BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+
+MERSENNE_PRIME = (1 << 31) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def normalized_tokens(target_path):
+    """
+    Returns the code tokens of a package with its own name and version masked,
+    so packages re-uploaded under another name or version look the same.
+    The metadata files are left out for the same reason.
+    """
+    package_name, version = read_metadata(target_path)
+    masks = []
+    for value, placeholder in ((package_name, " pkgname "), (version, " pkgversion ")):
+        variants = {value, value.replace("-", "_"), value.replace("_", "-")}
+        # very short values would be masked inside unrelated identifiers
+        variants = [variant for variant in variants if len(variant) >= 3]
+        for variant in sorted(variants, key=len, reverse=True):
+            masks.append((re.compile(re.escape(variant), re.IGNORECASE), placeholder))
+    tokens = []
+    for relpath, text in collect_files(target_path):
+        if os.path.basename(relpath) in METADATA_FILES:
+            continue
+        for pattern, placeholder in masks:
+            text = pattern.sub(placeholder, text)
+        tokens.extend(tokenize(text))
+    return tokens
+
+
+def shingle_hashes(tokens, size=SHINGLE_SIZE):
+    shingles = {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "big")
+            for s in shingles
+        ],
+        dtype=np.uint64,
+    )
+
+
+def permutations(num_perm=NUM_PERM, seed=1):
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    return a, b
+
+
+def minhash(hashes, num_perm=NUM_PERM):
+    """
+    Returns the MinHash signature of a set of 32-bit hashes, or None for an empty set.
+    """
+    if len(hashes) == 0:
+        return None
+    a, b = permutations(num_perm)
+    signature = np.full(num_perm, MAX_HASH, dtype=np.uint64)
+    # a < 2^31 and hashes < 2^32, so the products fit in 64 bits;
+    # blocks keep large packages from allocating one huge matrix
+    for start in range(0, len(hashes), 4096):
+        values = (np.outer(hashes[start : start + 4096], a) + b) % MERSENNE_PRIME
+        signature = np.minimum(signature, values.min(axis=0))
+    return signature
+
+
+def package_signature(target_path):
+    return minhash(shingle_hashes(normalized_tokens(target_path)))
+
+
+def similarity(left, right):
+    return float(np.mean(left == right))
+
+
+def cluster_packages(
+    target_paths, threshold=DEFAULT_THRESHOLD, bands=BANDS, max_workers=None
+):
+    """
+    Groups near-duplicate packages with MinHash/LSH over normalized token shingles.
+    Returns {representative: (cluster_id, [other members])} covering every path;
+    packages without code are never clustered.
+    """
+    target_paths = sorted(target_paths)
+    if not target_paths:
+        return {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        signatures = list(executor.map(package_signature, target_paths, chunksize=8))
+
+    parents = list(range(len(target_paths)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    rows = NUM_PERM // bands
+    buckets = {}
+    for i, signature in enumerate(signatures):
+        if signature is None:
+            continue
+        for band in range(bands):
+            key = (band, signature[band * rows : (band + 1) * rows].tobytes())
+            buckets.setdefault(key, []).append(i)
+    for candidates in buckets.values():
+        for j, other in enumerate(candidates[1:], start=1):
+            for first in candidates[:j]:
+                # LSH only proposes pairs, the signatures decide
+                if find(first) != find(other) and (
+                    similarity(signatures[first], signatures[other]) >= threshold
+                ):
+                    parents[find(other)] = find(first)
+
+    members = {}
+    for i, target_path in enumerate(target_paths):
+        members.setdefault(find(i), []).append(target_path)
+    clusters = {}
+    for paths in members.values():
+        representative = paths[0]
+        cluster_id = hashlib.sha1(
+            os.path.basename(representative).encode("utf-8")
+        ).hexdigest()[:12]
+        clusters[representative] = (cluster_id, paths[1:])
+    return clusters
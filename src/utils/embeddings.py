@@ -0,0 +1,65 @@
+import array
+import base64
+from langchain_core.embeddings import Embeddings
+from src.utils.cache import DiskCache, make_key
+from src.utils.metrics import metrics
+from src.utils.models import get_model_name
+
+
+# about 65k vectors of 1536 dimensions
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def pack_vector(vector):
+    # float64, so cached vectors are exactly the ones the provider returned
+    return base64.b64encode(array.array("d", vector).tobytes()).decode("ascii")
+
+
+def unpack_vector(text):
+    return array.array("d", base64.b64decode(text)).tolist()
+
+
+class CachedEmbedding(Embeddings):
+    """
+    CachedEmbedding keeps the vectors of an embedding model in a DiskCache keyed by
+    model name and text hash. A batch is looked up at once and only the misses are
+    sent to the model.
+    """
+
+    def __init__(self, embeddings, cache, name=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        # agents name their collections after the model, so keep its name
+        self.model = get_model_name(embeddings)
+        self.namespace = f"{type(embeddings).__name__}:{name or self.model}"
+
+    def cached(self, kind, texts, embed):
+        # providers may embed queries and documents differently, so they never mix
+        keys = [make_key(kind, self.namespace, text) for text in texts]
+        found = self.cache.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        metrics.inc("embedding_cache_hits", len(keys) - len(missing), model=self.model)
+        metrics.inc("embedding_cache_misses", len(missing), model=self.model)
+        if missing:
+            vectors = embed(list(missing.values()))
+            computed = {
+                key: pack_vector(vector) for key, vector in zip(missing, vectors)
+            }
+            self.cache.set_many(computed)
+            found.update(computed)
+        return [unpack_vector(found[key]) for key in keys]
+
+    def embed_documents(self, texts):
+        return self.cached("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self.cached(
+            "query", [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+
+def cached_embedding(embeddings, cache_path, name=None, max_bytes=DEFAULT_MAX_BYTES):
+    return CachedEmbedding(embeddings, DiskCache(cache_path, max_bytes=max_bytes), name)
@@ -0,0 +1,233 @@
+import os
+import re
+import io
+import tokenize
+
+
+METADATA_FILES = ("PKG-INFO", "METADATA")
+
+# directories that hold bundled third-party code or build output
+SKIP_DIRS = {
+    "__pycache__",
+    ".git",
+    ".hg",
+    ".tox",
+    ".venv",
+    "venv",
+    "node_modules",
+    "site-packages",
+    "vendor",
+    "_vendor",
+    "vendored",
+    "third_party",
+}
+
+MAX_FILE_SIZE = 2 * 1024 * 1024
+MAX_LINE_LENGTH = 2000
+# characters kept at each end of an elided line
+ELIDE_KEEP = 400
+
+ENTRY_POINT_PATTERN = re.compile(r"=\s*([A-Za-z_][\w.]*)\s*:")
+
+# the format_file header of a Python file, whole or in part
+SOURCE_HEADER_PATTERN = re.compile(
+    r"^[^\n]*\.py(?: \((?:part|lines) [^)\n]*\))?:$", re.M
+)
+
+
+def estimate_tokens(text):
+    # roughly four characters per token for code on common BPE vocabularies
+    return len(text) // 4 + 1
+
+
+def elide(text, keep):
+    return f"{text[:keep]}<… {len(text) - 2 * keep} chars elided …>{text[-keep:]}"
+
+
+def read_text(path, max_bytes=None):
+    """
+    Decodes a source file. Files over max_bytes are read as their head and tail.
+    """
+    with open(path, "rb") as f:
+        data = f.read(max_bytes + 1 if max_bytes else -1)
+        if max_bytes and len(data) > max_bytes:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(size - max_bytes // 2)
+            tail = f.read()
+            return (
+                decode_text(data[: max_bytes // 2])
+                + f"<… {size - max_bytes} bytes elided …>"
+                + decode_text(tail)
+            )
+    return decode_text(data)
+
+
+def decode_text(data):
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        pass
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+        return data.decode(encoding)
+    except (SyntaxError, LookupError, UnicodeDecodeError):
+        return data.decode("utf-8", errors="replace")
+
+
+def elide_long_lines(text):
+    # payloads often hide in one huge line, so keep both of its ends instead of dropping it
+    lines = text.splitlines(keepends=True)
+    if all(len(line) <= MAX_LINE_LENGTH for line in lines):
+        return text
+    elided = []
+    for line in lines:
+        body = line.rstrip("\r\n")
+        if len(body) > MAX_LINE_LENGTH:
+            line = elide(body, ELIDE_KEEP) + line[len(body) :]
+        elided.append(line)
+    return "".join(elided)
+
+
+def entry_point_modules(target_path, relpaths):
+    modules = set()
+    for relpath in relpaths:
+        name = os.path.basename(relpath)
+        if name not in ("entry_points.txt", "setup.py", "setup.cfg"):
+            continue
+        try:
+            text = read_text(os.path.join(target_path, relpath))
+        except OSError:
+            continue
+        for module in ENTRY_POINT_PATTERN.findall(text):
+            modules.add(module.replace(".", "/") + ".py")
+            modules.add(module.replace(".", "/") + "/__init__.py")
+    return modules
+
+
+def file_rank(relpath, entry_modules):
+    name = os.path.basename(relpath)
+    if name in METADATA_FILES:
+        rank = 0
+    elif name == "setup.py":
+        rank = 1
+    elif name == "__init__.py":
+        rank = 2
+    elif name == "__main__.py" or any(relpath.endswith(m) for m in entry_modules):
+        rank = 3
+    else:
+        rank = 4
+    return rank, relpath.count("/"), relpath
+
+
+def list_files(target_path):
+    relpaths = []
+    for root, dirs, files in os.walk(target_path):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for file in files:
+            relpath = os.path.relpath(os.path.join(root, file), target_path)
+            relpaths.append(relpath.replace(os.sep, "/"))
+    return relpaths
+
+
+def collect_files(target_path, elide_lines=True):
+    """
+    Yields (relative path, text) for the package metadata and Python files under target_path,
+    most relevant first: metadata, setup.py, __init__.py, entry points, then by depth.
+    Only vendored directories are skipped; files over MAX_FILE_SIZE keep their head and tail,
+    and lines over MAX_LINE_LENGTH their ends unless elide_lines is False.
+    """
+    relpaths = list_files(target_path)
+    entry_modules = entry_point_modules(target_path, relpaths)
+    candidates = [
+        relpath
+        for relpath in relpaths
+        if relpath.endswith(".py") or os.path.basename(relpath) in METADATA_FILES
+    ]
+    candidates.sort(key=lambda relpath: file_rank(relpath, entry_modules))
+    for relpath in candidates:
+        path = os.path.join(target_path, relpath)
+        if not os.path.isfile(path):
+            continue
+        text = read_text(path, MAX_FILE_SIZE)
+        yield relpath, elide_long_lines(text) if elide_lines else text
+
+
+def read_metadata(target_path):
+    """
+    Returns the Name and Version fields from the first PKG-INFO/METADATA file under target_path.
+    """
+    for relpath in sorted(list_files(target_path), key=lambda p: p.count("/")):
+        if os.path.basename(relpath) not in METADATA_FILES:
+            continue
+        metadata = {}
+        for line in read_text(os.path.join(target_path, relpath)).splitlines():
+            if not line.strip():
+                break
+            key, _, value = line.partition(":")
+            if key in ("Name", "Version") and key not in metadata:
+                metadata[key] = value.strip()
+        return metadata.get("Name", ""), metadata.get("Version", "")
+    return "", ""
+
+
+def format_file(relpath, text):
+    return relpath + ":\n" + text + "\n"
+
+
+def source_part(content):
+    """
+    Returns the content from its first Python file on, without the metadata that
+    chunk_files and triage put at its head; metadata-only content is returned whole.
+    """
+    match = SOURCE_HEADER_PATTERN.search(content)
+    return content[match.start() :] if match else content
+
+
+def split_text(relpath, text, token_budget):
+    # split a single oversized file on line boundaries
+    parts = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = estimate_tokens(line)
+        if current and size + line_tokens > token_budget:
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += line_tokens
+    if current:
+        parts.append("".join(current))
+    return [
+        format_file(f"{relpath} (part {i + 1}/{len(parts)})", part)
+        for i, part in enumerate(parts)
+    ]
+
+
+def chunk_files(target_path, token_budget):
+    """
+    Packs the collected files into chunks of at most token_budget estimated tokens.
+    Package metadata is repeated at the head of every chunk so each one can be analyzed on its own.
+    """
+    header = ""
+    sections = []
+    for relpath, text in collect_files(target_path):
+        if not header and os.path.basename(relpath) in METADATA_FILES:
+            header = format_file(relpath, text)
+            continue
+        section = format_file(relpath, text)
+        section_budget = max(token_budget - estimate_tokens(header), token_budget // 2)
+        if estimate_tokens(section) > section_budget:
+            sections.extend(split_text(relpath, text, section_budget))
+        else:
+            sections.append(section)
+
+    chunks = []
+    current = header
+    for section in sections:
+        if current != header and estimate_tokens(current + section) > token_budget:
+            chunks.append(current)
+            current = header
+        current += section
+    if current != header or not chunks:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,172 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    def __init__(self, owner, name, fn, args, kwargs, key=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.owner = owner
+        self.name = name
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.result = None
+        self.cancelled = threading.Event()
+
+    def progress(self):
+        now = self.finished or time.time()
+        elapsed = now - self.started if self.started else 0.0
+        throughput = self.done / elapsed if elapsed > 0 and self.done else None
+        eta = None
+        if throughput and self.status == RUNNING and self.total:
+            eta = (self.total - self.done) / throughput
+        return {
+            "id": self.id,
+            "name": self.name,
+            "owner": self.owner,
+            "status": self.status,
+            "done": self.done,
+            "total": self.total,
+            "elapsed": round(elapsed, 1),
+            "per_second": round(throughput, 3) if throughput else None,
+            "eta": round(eta, 1) if eta is not None else None,
+            "error": self.error,
+        }
+
+
+class JobRunner:
+    """
+    JobRunner runs progress generators (yielding (done, total)) on background threads,
+    so they outlive Streamlit reruns and closed browser tabs. Owners (sessions) are
+    served round-robin, and jobs sharing a key never run at the same time.
+    A job is cancelled by closing its generator at the next progress step.
+    """
+
+    def __init__(self, max_workers=2, keep=200):
+        self.max_workers = max_workers
+        self.keep = keep
+        self.jobs = OrderedDict()
+        self.queues = OrderedDict()
+        self.running_keys = set()
+        self.workers = []
+        self.condition = threading.Condition()
+
+    def submit(self, owner, name, fn, *args, key=None, **kwargs):
+        job = Job(owner, name, fn, args, kwargs, key=key)
+        with self.condition:
+            self.jobs[job.id] = job
+            self.queues.setdefault(owner, deque()).append(job)
+            self.forget_finished()
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self.work, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+            self.condition.notify_all()
+        return job.id
+
+    def forget_finished(self):
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status in (DONE, FAILED, CANCELLED)
+        ]
+        for job_id in finished[: max(len(self.jobs) - self.keep, 0)]:
+            del self.jobs[job_id]
+
+    def next_job(self):
+        # first runnable job of the least recently served owner
+        for owner, queue in list(self.queues.items()):
+            for job in queue:
+                if job.key is None or job.key not in self.running_keys:
+                    queue.remove(job)
+                    self.queues.move_to_end(owner)
+                    if not queue:
+                        del self.queues[owner]
+                    return job
+        return None
+
+    def work(self):
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self.next_job()
+                if job.key is not None:
+                    self.running_keys.add(job.key)
+            try:
+                self.run(job)
+            finally:
+                with self.condition:
+                    self.running_keys.discard(job.key)
+                    self.condition.notify_all()
+
+    def run(self, job):
+        if job.cancelled.is_set():
+            job.status = CANCELLED
+            job.finished = time.time()
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        generator = None
+        try:
+            generator = job.fn(*job.args, **job.kwargs)
+            while True:
+                if job.cancelled.is_set():
+                    generator.close()
+                    job.status = CANCELLED
+                    break
+                try:
+                    job.done, job.total = next(generator)
+                except StopIteration as stop:
+                    job.result = stop.value
+                    job.status = DONE
+                    break
+        except Exception as e:
+            logging.exception(f"Job {job.name} failed")
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = FAILED
+        job.finished = time.time()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, owner=None):
+        with self.condition:
+            jobs = list(self.jobs.values())
+        return [job for job in jobs if owner is None or job.owner == owner]
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+            with self.condition:
+                queue = self.queues.get(job.owner)
+                if job.status == QUEUED and queue is not None and job in queue:
+                    queue.remove(job)
+                    if not queue:
+                        del self.queues[job.owner]
+                    job.status = CANCELLED
+                    job.finished = time.time()
+
+
+# process-wide, so jobs keep running across reruns and sessions
+job_runner = JobRunner()
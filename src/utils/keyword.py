@@ -0,0 +1,86 @@
+import re
+import math
+from collections import Counter, defaultdict
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_\-.]*[a-z0-9]|[a-z0-9]")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def phrase_index(phrases):
+    """
+    Indexes {phrase: value} by the first token of each phrase, for find_phrases.
+    """
+    index = defaultdict(list)
+    for phrase, value in phrases.items():
+        tokens = tuple(tokenize(phrase))
+        if tokens:
+            index[tokens[0]].append((tokens, value))
+    return dict(index)
+
+
+def find_phrases(index, text):
+    """
+    Returns the values of the indexed phrases that occur in the text as whole tokens.
+    """
+    tokens = tokenize(text)
+    found = set()
+    for start, token in enumerate(tokens):
+        for phrase, value in index.get(token, ()):
+            if tuple(tokens[start : start + len(phrase)]) == phrase:
+                found.add(value)
+    return found
+
+
+class BM25Index:
+    """
+    BM25Index is an in-memory Okapi BM25 keyword index over document ids.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, doc_id, text):
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self.postings[term][doc_id] = tf
+        length = sum(terms.values())
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, query, k=10):
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=10, constant=60):
+    """
+    Fuses several ranked id lists into one, best first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1 / (constant + rank + 1)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda x: -x[1])][:k]
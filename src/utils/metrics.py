@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+# upper bounds in seconds, shared by every latency histogram
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# (prompt, completion) price per 1K tokens in the provider's billing currency;
+# models without a price still have their tokens counted
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Metrics collects counters, latency histograms and per-item events in memory.
+    One process-wide instance, `metrics`, is shared by the agents and the import code.
+    """
+
+    def __init__(self, max_events=10000):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.events = deque(maxlen=max_events)
+        self.prices = dict(MODEL_PRICES)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, label_key(labels))] += value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            key = (name, label_key(labels))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def record(self, event, **fields):
+        with self.lock:
+            self.events.append({"event": event, "time": time.time(), **fields})
+
+    def set_price(self, model, prompt_price, completion_price):
+        self.prices[model] = (prompt_price, completion_price)
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        if model not in self.prices:
+            return None
+        prompt_price, completion_price = self.prices[model]
+        return (
+            prompt_tokens * prompt_price + completion_tokens * completion_price
+        ) / 1000
+
+    @contextmanager
+    def stage(self, stage, **fields):
+        """
+        Times a whole stage run (unzip, analyze, import ...) as stage_seconds.
+        """
+        start = time.monotonic()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.monotonic() - start
+            self.observe("stage_seconds", seconds, stage=stage)
+            self.record("stage", stage=stage, seconds=seconds, error=error, **fields)
+
+    def item(self, stage, item, seconds, callback=None, **fields):
+        """
+        Records one package or query, with the LLM usage collected by its callback.
+        """
+        self.observe("item_seconds", seconds, stage=stage)
+        if callback is not None:
+            fields.update(callback.summary())
+        self.record("item", stage=stage, item=item, seconds=seconds, **fields)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                key: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95))
+                for key, h in self.histograms.items()
+            }
+        latencies = [
+            {
+                "metric": name,
+                **dict(labels),
+                "count": count,
+                "mean_s": round(total / count, 3) if count else None,
+                "p50_s": p50,
+                "p95_s": p95,
+            }
+            for (name, labels), (count, total, p50, p95) in sorted(histograms.items())
+        ]
+        models = defaultdict(lambda: defaultdict(float))
+        for (name, labels), value in counters.items():
+            model = dict(labels).get("model")
+            if model is not None and name.startswith("llm_"):
+                # summed over the other labels, e.g. stage
+                models[model][name[len("llm_") :]] += value
+        return {
+            "latencies": latencies,
+            "models": [{"model": model, **values} for model, values in models.items()],
+        }
+
+    def prometheus(self, prefix="genttp_"):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, list(h.buckets), list(h.counts), h.count, h.sum)
+                for key, h in self.histograms.items()
+            )
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} counter")
+            lines.append(f"{prefix}{name}{format_labels(labels)} {value}")
+        for (name, labels), buckets, counts, count, total in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {prefix}{name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{prefix}{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{prefix}{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, jsonl_path, prometheus_path):
+        """
+        Writes the buffered events as JSONL and the aggregates in the Prometheus text format.
+        """
+        for path in (jsonl_path, prometheus_path):
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.lock:
+            events = list(self.events)
+        with open(jsonl_path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        tmp_path = prometheus_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus())
+        # scrapers may read the file at any time, so replace it atomically
+        os.replace(tmp_path, prometheus_path)
+        return len(events)
+
+
+metrics = Metrics()
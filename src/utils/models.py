@@ -0,0 +1,66 @@
+def get_model_name(llm):
+    for attr in ("model_name", "model", "model_id"):
+        name = getattr(llm, attr, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(llm).__name__
+
+
+def create_llm(provider, model_name, api_key, secret_key=None):
+    if provider == "dashscope":
+        from langchain_community.llms import tongyi
+
+        return tongyi.Tongyi(dashscope_api_key=api_key, model_name=model_name)
+    if provider == "qianfan":
+        from langchain_community.llms import baidu_qianfan_endpoint
+
+        return baidu_qianfan_endpoint.QianfanLLMEndpoint(
+            model=model_name, qianfan_ak=api_key, qianfan_sk=secret_key
+        )
+    if provider == "volcano":
+        from langchain_community.llms import volcengine_maas
+
+        return volcengine_maas.VolcEngineMaasLLM(
+            model=model_name,
+            volc_engine_maas_ak=api_key,
+            volc_engine_maas_sk=secret_key,
+        )
+    if provider == "openai":
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            openai_api_key=api_key,
+            model_name=model_name,
+            base_url="https://api.openai-hub.com/v1",
+        )
+    raise ValueError(f"Unknown provider: {provider}")
+
+
+def create_embedding(provider, embedding_name, api_key, secret_key=None):
+    if provider == "dashscope":
+        from langchain_community.embeddings import DashScopeEmbeddings
+
+        return DashScopeEmbeddings(dashscope_api_key=api_key, model=embedding_name)
+    if provider == "qianfan":
+        from langchain_community.embeddings import baidu_qianfan_endpoint
+
+        return baidu_qianfan_endpoint.QianfanEmbeddingsEndpoint(
+            model=embedding_name, qianfan_ak=api_key, qianfan_sk=secret_key
+        )
+    if provider == "volcano":
+        from langchain_community.embeddings import volcengine
+
+        return volcengine.VolcanoEmbeddings(
+            model=embedding_name,
+            volcano_ak=api_key,
+            volcano_sk=secret_key,
+        )
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(
+            openai_api_key=api_key,
+            model=embedding_name,
+            base_url="https://api.openai-hub.com/v1",
+        )
+    raise ValueError(f"Unknown provider: {provider}")
@@ -0,0 +1,41 @@
+import time
+import asyncio
+import threading
+
+
+class RateLimiter:
+    """
+    RateLimiter is a thread-safe token bucket allowing `rate` units per `per` seconds.
+    Callers acquire units before each request instead of sleeping a fixed interval.
+    """
+
+    def __init__(self, rate, per=60.0):
+        self.rate = float(rate)
+        self.per = float(per)
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, n=1):
+        # take n units now and return how long the caller has to wait for them
+        n = min(float(n), self.rate)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate, self.tokens + (now - self.updated) * self.rate / self.per
+            )
+            self.updated = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens * self.per / self.rate
+
+    def acquire(self, n=1):
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, n=1):
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
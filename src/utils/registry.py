@@ -0,0 +1,73 @@
+import time
+import threading
+
+
+class SharedRegistry:
+    """
+    SharedRegistry holds process-wide resources keyed by their configuration.
+    Each key is created once and reference counted by holder (a browser session);
+    since sessions can vanish without notice, a holder that has not touched an
+    entry for idle_timeout seconds no longer counts, and unheld entries are evicted.
+    """
+
+    def __init__(self, idle_timeout=1800):
+        self.idle_timeout = idle_timeout
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key, holder, factory):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {"value": None, "holders": {}, "ready": threading.Lock()}
+                self.entries[key] = entry
+            entry["holders"][holder] = time.monotonic()
+        # create outside the registry lock so slow factories only block their own key
+        with entry["ready"]:
+            if entry["value"] is None:
+                try:
+                    entry["value"] = factory()
+                except Exception:
+                    with self.lock:
+                        if self.entries.get(key) is entry:
+                            del self.entries[key]
+                    raise
+        self.evict_idle()
+        return entry["value"]
+
+    def touch(self, key, holder):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["value"] is None:
+                return None
+            entry["holders"][holder] = time.monotonic()
+            return entry["value"]
+
+    def release(self, key, holder):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["holders"].pop(holder, None)
+        self.evict_idle()
+
+    def refcount(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return 0 if entry is None else len(entry["holders"])
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for key in list(self.entries):
+                entry = self.entries[key]
+                entry["holders"] = {
+                    holder: seen
+                    for holder, seen in entry["holders"].items()
+                    if now - seen < self.idle_timeout
+                }
+                if not entry["holders"] and entry["value"] is not None:
+                    del self.entries[key]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
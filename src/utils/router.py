@@ -0,0 +1,237 @@
+import time
+import random
+import logging
+import threading
+from typing import Any, List
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, GenerationChunk, LLMResult
+from src.utils.files import estimate_tokens
+from src.utils.metrics import metrics
+from src.utils.models import get_model_name
+from src.utils.ratelimit import RateLimiter
+
+
+# HTTP statuses worth trying on another provider
+FAILOVER_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# the router's own run reports the call; without this the provider's run would
+# inherit the chain's callbacks and be counted a second time
+INNER_CONFIG = {"callbacks": []}
+
+
+def is_failover_error(error):
+    status = getattr(error, "status_code", None) or getattr(
+        getattr(error, "response", None), "status_code", None
+    )
+    if status in FAILOVER_STATUSES:
+        return True
+    if isinstance(error, TimeoutError):
+        return True
+    name = type(error).__name__.lower()
+    text = str(error).lower()
+    return (
+        "ratelimit" in name
+        or "timeout" in name
+        or "429" in text
+        or "rate limit" in text
+        or "timed out" in text
+    )
+
+
+def message_text(message):
+    # chat models return messages, completion models plain strings
+    return getattr(message, "content", message)
+
+
+def message_usage(message):
+    metadata = getattr(message, "usage_metadata", None) or {}
+    if metadata:
+        return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage")
+    if usage:
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return None, None
+
+
+class Route:
+    """
+    Route is one provider behind a RouterLLM, with its weight, concurrency and
+    requests / tokens per minute limits.
+    """
+
+    def __init__(
+        self,
+        llm,
+        name=None,
+        weight=1.0,
+        max_concurrency=4,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+    ):
+        self.llm = llm
+        self.name = name or get_model_name(llm)
+        self.weight = float(weight)
+        self.max_concurrency = max_concurrency
+        # the semaphore bounds the calls, active (under lock) is what routing reads
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.requests = (
+            RateLimiter(requests_per_minute) if requests_per_minute else None
+        )
+        self.tokens = RateLimiter(tokens_per_minute) if tokens_per_minute else None
+        self.active = 0
+        self.cooldown_until = 0.0
+
+    def acquire(self, prompt_tokens):
+        self.slots.acquire()
+        with self.lock:
+            self.active += 1
+        try:
+            if self.requests is not None:
+                self.requests.acquire()
+            if self.tokens is not None:
+                self.tokens.acquire(prompt_tokens)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self, completion_tokens=0):
+        try:
+            if self.tokens is not None and completion_tokens:
+                # charged afterwards, so the next callers wait for it
+                self.tokens.reserve(completion_tokens)
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+
+
+class RouterLLM(LLM):
+    """
+    RouterLLM spreads calls over several provider LLMs by weight, within each one's
+    concurrency and rate limits. On a 429 or a timeout the provider cools down and the
+    call fails over to the next one. The provider used is reported as "route" in the
+    LLM output, so callbacks can attribute tokens and results to it.
+    """
+
+    routes: List[Any]
+    cooldown: float = 30.0
+    model_name: str = "router"
+
+    @property
+    def _llm_type(self):
+        return "router"
+
+    @classmethod
+    def from_routes(cls, routes, cooldown=30.0):
+        names = "+".join(route.name for route in routes)
+        return cls(routes=routes, cooldown=cooldown, model_name=f"router:{names}")
+
+    def ordered_routes(self):
+        # weighted shuffle (Efraimidis-Spirakis), then routes with a free slot first
+        # and cooling down ones last, so the weights only decide between equals
+        now = time.monotonic()
+        keyed = [
+            (
+                route.cooldown_until > now,
+                route.active >= route.max_concurrency,
+                -(random.random() ** (1.0 / max(route.weight, 1e-6))),
+                index,
+            )
+            for index, route in enumerate(self.routes)
+        ]
+        return [self.routes[key[-1]] for key in sorted(keyed)]
+
+    def fail(self, route, error):
+        route.cooldown_until = time.monotonic() + self.cooldown
+        metrics.inc("llm_failovers", model=route.name)
+        logging.warning(f"{route.name} failed, trying the next provider: {error}")
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        generations = []
+        prompt_tokens = completion_tokens = 0
+        for prompt in prompts:
+            route, message = self.call(prompt, stop, **kwargs)
+            used_prompt, used_completion = message_usage(message)
+            prompt_tokens += used_prompt or 0
+            completion_tokens += used_completion or 0
+            generations.append(
+                [
+                    Generation(
+                        text=message_text(message),
+                        generation_info={"route": route.name},
+                    )
+                ]
+            )
+        return LLMResult(
+            generations=generations,
+            llm_output={
+                "route": route.name,
+                "token_usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                },
+            },
+        )
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return message_text(self.call(prompt, stop, **kwargs)[1])
+
+    def call(self, prompt, stop=None, **kwargs):
+        error = None
+        prompt_tokens = estimate_tokens(prompt)
+        for route in self.ordered_routes():
+            route.acquire(prompt_tokens)
+            completion_tokens = 0
+            try:
+                message = route.llm.invoke(prompt, INNER_CONFIG, stop=stop, **kwargs)
+                completion_tokens = message_usage(message)[1] or estimate_tokens(
+                    message_text(message)
+                )
+                return route, message
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                self.fail(route, e)
+                error = e
+            finally:
+                route.release(completion_tokens)
+        raise error
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        error = None
+        prompt_tokens = estimate_tokens(prompt)
+        for route in self.ordered_routes():
+            route.acquire(prompt_tokens)
+            completion_tokens = 0
+            started = False
+            try:
+                for chunk in route.llm.stream(
+                    prompt, INNER_CONFIG, stop=stop, **kwargs
+                ):
+                    text = message_text(chunk)
+                    started = True
+                    completion_tokens += estimate_tokens(text)
+                    if run_manager is not None:
+                        run_manager.on_llm_new_token(text)
+                    yield GenerationChunk(
+                        text=text, generation_info={"route": route.name}
+                    )
+                return
+            except Exception as e:
+                # once text was sent, switching providers would mix two replies
+                if started or not is_failover_error(e):
+                    raise
+                self.fail(route, e)
+                error = e
+            finally:
+                route.release(completion_tokens)
+        raise error
+
+
+def create_router(routes, cooldown=30.0):
+    """
+    Takes route settings (llm, name, weight, max_concurrency, requests_per_minute,
+    tokens_per_minute) and returns a RouterLLM over them.
+    """
+    return RouterLLM.from_routes([Route(**route) for route in routes], cooldown)
@@ -0,0 +1,68 @@
+import os
+import json
+import threading
+
+
+class JsonlSink:
+    """
+    JsonlSink appends one JSON record per line and flushes after every write,
+    so each result costs O(1) I/O no matter how large the file grows.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self.write_many([record])
+
+    def write_many(self, records):
+        lines = "".join(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        )
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def read_jsonl(path):
+    if not os.path.isfile(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a torn last line from a killed run
+                continue
+
+
+def export_table(sink_path, output_path, columns=None, dedupe=None):
+    """
+    Compacts a JSONL sink into one .xlsx or .csv file, written once.
+    With dedupe, only the last record for each value of those columns is kept.
+    """
+    import pandas as pd
+
+    df = pd.DataFrame(list(read_jsonl(sink_path)), columns=columns)
+    if dedupe and not df.empty:
+        df = df.drop_duplicates(subset=dedupe, keep="last")
+    if output_path.endswith(".csv"):
+        df.to_csv(output_path, index=False)
+    else:
+        df.to_excel(output_path, index=False, engine="openpyxl")
+    return len(df)
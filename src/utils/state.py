@@ -0,0 +1,165 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+STAGES = ["unzip", "analyze", "import"]
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def hash_tree(target_path):
+    """
+    Cheap fingerprint of a directory from the relative path, size and mtime of its files.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(target_path):
+        dirs.sort()
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            relpath = os.path.relpath(path, target_path)
+            digest.update(f"{relpath}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+class PipelineState:
+    """
+    PipelineState records, per package and stage, the status, input hash, timings and
+    last error in SQLite. Stages only pick up items that are new, changed, failed or
+    were left running by a crashed run.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "name TEXT, stage TEXT, status TEXT, hash TEXT, started REAL, "
+            "finished REAL, seconds REAL, error TEXT, PRIMARY KEY (name, stage))"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS items_stage_status ON items (stage, status)"
+        )
+        self.conn.commit()
+
+    def rows(self, stage, names):
+        rows = {}
+        names = list(names)
+        with self.lock:
+            for start in range(0, len(names), 500):
+                chunk = names[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.update(
+                    (name, (status, content_hash))
+                    for name, status, content_hash in self.conn.execute(
+                        "SELECT name, status, hash FROM items "
+                        f"WHERE stage = ? AND name IN ({placeholders})",
+                        [stage] + chunk,
+                    )
+                )
+        return rows
+
+    def pending(self, stage, hashes):
+        """
+        Takes {name: input hash} and returns {name: previous status or None} for the
+        items that still have to run.
+        """
+        rows = self.rows(stage, hashes)
+        pending = {}
+        for name, content_hash in hashes.items():
+            status, previous_hash = rows.get(name, (None, None))
+            if status != DONE or previous_hash != content_hash:
+                pending[name] = status
+        return pending
+
+    def discover(self, stage, names):
+        # register items seen on disk, without touching the ones already known
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO items (name, stage, status, started) "
+                "VALUES (?, ?, ?, ?)",
+                [(name, stage, PENDING, now) for name in names],
+            )
+            self.conn.commit()
+
+    def start(self, stage, names):
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO items (name, stage, status, started) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name, stage) DO UPDATE SET "
+                "status = excluded.status, started = excluded.started",
+                [(name, stage, RUNNING, now) for name in names],
+            )
+            self.conn.commit()
+
+    def finish(self, stage, name, content_hash=None, error=None, started=None):
+        now = time.time()
+        with self.lock:
+            if started is None:
+                row = self.conn.execute(
+                    "SELECT started FROM items WHERE name = ? AND stage = ?",
+                    (name, stage),
+                ).fetchone()
+                started = row[0] if row and row[0] else now
+            self.conn.execute(
+                "INSERT OR REPLACE INTO items "
+                "(name, stage, status, hash, started, finished, seconds, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    name,
+                    stage,
+                    FAILED if error else DONE,
+                    None if error else content_hash,
+                    started,
+                    now,
+                    now - started,
+                    error,
+                ),
+            )
+            self.conn.commit()
+
+    def counts(self):
+        """
+        Returns {stage: {status: count}}.
+        """
+        counts = {stage: {} for stage in STAGES}
+        with self.lock:
+            for stage, status, count in self.conn.execute(
+                "SELECT stage, status, COUNT(*) FROM items GROUP BY stage, status"
+            ):
+                counts.setdefault(stage, {})[status] = count
+        return counts
+
+    def items(self, stage=None, status=None, limit=50, offset=0):
+        clauses = []
+        params = []
+        for column, value in (("stage", stage), ("status", status)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        with self.lock:
+            total = self.conn.execute(
+                f"SELECT COUNT(*) FROM items{where}", params
+            ).fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT name, stage, status, started, finished, seconds, error "
+                f"FROM items{where} ORDER BY name, stage LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return rows, total
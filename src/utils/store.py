@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from src.utils.data import split_ttp
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    package TEXT,
+    version TEXT,
+    ecosystem TEXT,
+    model TEXT,
+    route TEXT,
+    folder TEXT,
+    verdict TEXT,
+    created_at REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    result TEXT,
+    UNIQUE (folder, model)
+);
+CREATE TABLE IF NOT EXISTS ttps (
+    analysis_id INTEGER REFERENCES analyses (id) ON DELETE CASCADE,
+    tag TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_package ON analyses (package, version);
+CREATE INDEX IF NOT EXISTS analyses_ecosystem ON analyses (ecosystem, created_at);
+CREATE INDEX IF NOT EXISTS analyses_model ON analyses (model);
+CREATE INDEX IF NOT EXISTS analyses_created_at ON analyses (created_at);
+CREATE INDEX IF NOT EXISTS ttps_tag ON ttps (tag);
+CREATE INDEX IF NOT EXISTS ttps_analysis ON ttps (analysis_id);
+"""
+
+
+class ResultStore:
+    """
+    ResultStore keeps one indexed row per analyzed package (and model) in SQLite, with its
+    TTP tags in a separate table, so fleet-wide questions never re-read the JSON files.
+    For a RouterLLM, model is the router and route the provider that answered.
+    """
+
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(analyses)")}
+        if "route" not in columns:
+            self.conn.execute("ALTER TABLE analyses ADD COLUMN route TEXT")
+        self.conn.commit()
+
+    def add(
+        self,
+        result,
+        folder,
+        model,
+        prompt_tokens=None,
+        completion_tokens=None,
+        created_at=None,
+        route=None,
+    ):
+        verdict = (result.get("triage") or {}).get("verdict", "analyzed")
+        with self.lock:
+            # a re-analysis of the same folder by the same model replaces the old row
+            self.conn.execute(
+                "DELETE FROM analyses WHERE folder = ? AND model = ?", (folder, model)
+            )
+            cursor = self.conn.execute(
+                "INSERT INTO analyses (package, version, ecosystem, model, route, "
+                "folder, verdict, created_at, prompt_tokens, completion_tokens, "
+                "result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(result.get("package_name", "") or "").lower(),
+                    str(result.get("version", "") or ""),
+                    str(result.get("ecosystem", "") or "").lower(),
+                    model,
+                    route,
+                    folder,
+                    verdict,
+                    created_at or time.time(),
+                    prompt_tokens,
+                    completion_tokens,
+                    json.dumps(result),
+                ),
+            )
+            self.conn.executemany(
+                "INSERT INTO ttps (analysis_id, tag) VALUES (?, ?)",
+                # the same tags as the Chroma metadata filters
+                [
+                    (cursor.lastrowid, tag)
+                    for tag in sorted(set(split_ttp(result.get("TTP"))))
+                ],
+            )
+            self.conn.commit()
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def filters(self, ecosystem=None, since=None, until=None, model=None):
+        clauses = []
+        params = []
+        for clause, value in (
+            ("a.ecosystem = ?", ecosystem),
+            ("a.created_at >= ?", since),
+            ("a.created_at < ?", until),
+            ("a.model = ?", model),
+        ):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def ttp_frequency(self, ecosystem=None, since=None, until=None, model=None):
+        """
+        Returns [(ecosystem, tag, packages)] ordered by frequency.
+        since and until are UNIX timestamps.
+        """
+        where, params = self.filters(ecosystem, since, until, model)
+        return self.query(
+            "SELECT a.ecosystem, t.tag, COUNT(DISTINCT a.package) AS packages "
+            f"FROM ttps t JOIN analyses a ON a.id = t.analysis_id{where} "
+            "GROUP BY a.ecosystem, t.tag ORDER BY packages DESC, t.tag",
+            params,
+        )
+
+    def summary(self, ecosystem=None, since=None, until=None, model=None):
+        """
+        Returns [(ecosystem, model, verdict, analyses, prompt_tokens, completion_tokens)].
+        """
+        where, params = self.filters(ecosystem, since, until, model)
+        return self.query(
+            "SELECT a.ecosystem, a.model, a.verdict, COUNT(*), "
+            "COALESCE(SUM(a.prompt_tokens), 0), COALESCE(SUM(a.completion_tokens), 0) "
+            f"FROM analyses a{where} GROUP BY a.ecosystem, a.model, a.verdict",
+            params,
+        )
+
+    def rows(self, ecosystem=None, since=None, until=None, model=None):
+        where, params = self.filters(ecosystem, since, until, model)
+        return self.query(
+            "SELECT a.package, a.version, a.ecosystem, a.model, a.route, a.verdict, "
+            "GROUP_CONCAT(t.tag, '\n'), a.created_at, a.prompt_tokens, "
+            "a.completion_tokens, a.folder "
+            f"FROM analyses a LEFT JOIN ttps t ON a.id = t.analysis_id{where} "
+            "GROUP BY a.id ORDER BY a.created_at",
+            params,
+        )
+
+    def export_report(self, output_path, **filters):
+        """
+        Writes one row per analysis to .csv, or to .xlsx together with TTP frequency
+        and summary sheets. Returns the number of analyses exported.
+        """
+        import pandas as pd
+
+        report = pd.DataFrame(
+            self.rows(**filters),
+            columns=[
+                "package_name",
+                "version",
+                "ecosystem",
+                "model",
+                "route",
+                "verdict",
+                "TTP",
+                "created_at",
+                "prompt_tokens",
+                "completion_tokens",
+                "folder",
+            ],
+        )
+        report["created_at"] = pd.to_datetime(report["created_at"], unit="s")
+        if output_path.endswith(".csv"):
+            report.to_csv(output_path, index=False)
+            return len(report)
+        with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
+            report.to_excel(writer, sheet_name="analyses", index=False)
+            pd.DataFrame(
+                self.ttp_frequency(**filters),
+                columns=["ecosystem", "TTP", "packages"],
+            ).to_excel(writer, sheet_name="ttp_frequency", index=False)
+            pd.DataFrame(
+                self.summary(**filters),
+                columns=[
+                    "ecosystem",
+                    "model",
+                    "verdict",
+                    "analyses",
+                    "prompt_tokens",
+                    "completion_tokens",
+                ],
+            ).to_excel(writer, sheet_name="summary", index=False)
+        return len(report)
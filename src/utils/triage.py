@@ -0,0 +1,219 @@
+import os
+import re
+import ast
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils.files import (
+    MAX_FILE_SIZE,
+    MAX_LINE_LENGTH,
+    METADATA_FILES,
+    collect_files,
+    elide_long_lines,
+    format_file,
+)
+
+
+# weight of each suspicious call, keyed by the dotted name as written in the source
+CALL_RULES = {
+    "exec": ("exec", 3),
+    "eval": ("eval", 3),
+    "compile": ("exec", 2),
+    "__import__": ("dynamic-import", 2),
+    "importlib.import_module": ("dynamic-import", 1),
+    "base64.b64decode": ("decode", 2),
+    "base64.b32decode": ("decode", 2),
+    "base64.b85decode": ("decode", 2),
+    "b64decode": ("decode", 2),
+    "codecs.decode": ("decode", 1),
+    "zlib.decompress": ("decode", 2),
+    "marshal.loads": ("decode", 3),
+    "pickle.loads": ("decode", 1),
+    "os.system": ("cmd", 3),
+    "os.popen": ("cmd", 3),
+    "os.execv": ("cmd", 3),
+    "os.execl": ("cmd", 3),
+    "os.spawnl": ("cmd", 3),
+    "os.startfile": ("cmd", 3),
+    "pty.spawn": ("cmd", 3),
+    "subprocess.Popen": ("cmd", 3),
+    "subprocess.call": ("cmd", 3),
+    "subprocess.run": ("cmd", 3),
+    "subprocess.check_call": ("cmd", 3),
+    "subprocess.check_output": ("cmd", 3),
+    "socket.socket": ("network", 2),
+    "socket.create_connection": ("network", 2),
+    "urllib.request.urlopen": ("network", 2),
+    "urlopen": ("network", 2),
+    "requests.get": ("network", 1),
+    "requests.post": ("network", 2),
+    "urllib.request.urlretrieve": ("download", 3),
+    "ctypes.windll": ("native", 2),
+    "ctypes.CDLL": ("native", 2),
+}
+
+INSTALL_HOOK_BASES = {
+    "install",
+    "develop",
+    "egg_info",
+    "build_py",
+    "sdist",
+    "bdist_egg",
+}
+
+TEXT_RULES = [
+    ("encoded-blob", 2, re.compile(r"[A-Za-z0-9+/=]{200,}")),
+    ("hex-escape", 2, re.compile(r"(\\x[0-9a-fA-F]{2}){20,}")),
+    ("webhook", 3, re.compile(r"discord(app)?\.com/api/webhooks|api\.telegram\.org")),
+    ("paste-site", 2, re.compile(r"pastebin\.com|transfer\.sh|ngrok\.io|\.onion\b")),
+    ("raw-ip", 2, re.compile(r"https?://\d{1,3}(\.\d{1,3}){3}")),
+]
+
+CONTEXT_LINES = 3
+DEFAULT_THRESHOLD = 3
+
+
+def dotted_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        prefix = dotted_name(node.value)
+        return f"{prefix}.{node.attr}" if prefix else node.attr
+    return None
+
+
+def import_aliases(tree):
+    """
+    Maps the names bound by imports to what they import, e.g. {"sp": "subprocess"}
+    for `import subprocess as sp` and {"system": "os.system"} for `from os import system`.
+    """
+    aliases = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    aliases[alias.asname] = alias.name
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+    return aliases
+
+
+def resolve_name(name, aliases):
+    head, _, rest = name.partition(".")
+    if head not in aliases:
+        return name
+    return aliases[head] + ("." + rest if rest else "")
+
+
+def scan_tree(tree):
+    findings = []
+    scopes = []
+    aliases = import_aliases(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            scopes.append((node.lineno, node.end_lineno or node.lineno))
+        if isinstance(node, ast.Call):
+            name = dotted_name(node.func)
+            resolved = resolve_name(name, aliases) if name else None
+            # the bare names in CALL_RULES still match as written
+            for candidate in (resolved, name):
+                if candidate in CALL_RULES:
+                    rule, weight = CALL_RULES[candidate]
+                    findings.append((node.lineno, rule, weight))
+                    break
+        elif isinstance(node, ast.ClassDef):
+            bases = {(dotted_name(base) or "").split(".")[-1] for base in node.bases}
+            if bases & INSTALL_HOOK_BASES:
+                findings.append((node.lineno, "install-hook", 3))
+        elif isinstance(node, ast.keyword) and node.arg == "cmdclass":
+            findings.append((node.value.lineno, "install-hook", 3))
+    return findings, scopes
+
+
+def scan_source(text):
+    """
+    Returns (findings, scopes) for one Python source, where findings are (line, rule, weight).
+    Sources that do not parse are scanned with the text rules only.
+    """
+    try:
+        findings, scopes = scan_tree(ast.parse(text))
+    except (SyntaxError, ValueError, RecursionError):
+        findings, scopes = [], []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        # minified or packed code, which the text rules below may not describe
+        if len(line) > MAX_LINE_LENGTH:
+            findings.append((lineno, "long-line", 1))
+        for rule, weight, pattern in TEXT_RULES:
+            if pattern.search(line):
+                findings.append((lineno, rule, weight))
+    return findings, scopes
+
+
+def snippet_ranges(findings, scopes, line_count):
+    ranges = []
+    for lineno, _, _ in findings:
+        start = max(lineno - CONTEXT_LINES, 1)
+        end = min(lineno + CONTEXT_LINES, line_count)
+        # pull in the header of the innermost enclosing def so the call context is visible
+        enclosing = [scope for scope in scopes if scope[0] <= lineno <= scope[1]]
+        if enclosing:
+            header = max(enclosing)[0]
+            ranges.append((header, header))
+        ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def triage_package(target_path):
+    """
+    Statically scans a package and returns its suspicion score, the findings and
+    a condensed file content made of the metadata plus the suspicious snippets.
+    """
+    score = 0
+    findings = []
+    seen = set()
+    metadata = ""
+    snippets = ""
+    # every Python file is scanned with its long lines intact, they are elided in snippets only
+    for relpath, text in collect_files(target_path, elide_lines=False):
+        if os.path.basename(relpath) in METADATA_FILES:
+            if not metadata:
+                metadata = format_file(relpath, text)
+            continue
+        file_findings, scopes = scan_source(text)
+        if os.path.getsize(os.path.join(target_path, relpath)) > MAX_FILE_SIZE:
+            # only the head and tail were scanned
+            file_findings.append((1, "oversized-file", 2))
+        if not file_findings:
+            continue
+        for lineno, rule, weight in file_findings:
+            findings.append({"file": relpath, "line": lineno, "rule": rule})
+            # each rule counts once per file, repeated calls add no new evidence
+            if (relpath, rule) not in seen:
+                seen.add((relpath, rule))
+                score += weight
+        lines = text.splitlines()
+        for start, end in snippet_ranges(file_findings, scopes, len(lines)):
+            snippets += format_file(
+                f"{relpath} (lines {start}-{end})",
+                elide_long_lines("\n".join(lines[start - 1 : end])),
+            )
+    return {"score": score, "findings": findings, "content": metadata + snippets}
+
+
+def triage_packages(target_paths, max_workers=None):
+    """
+    Runs triage_package over many packages on a process pool, returning {path: result}.
+    """
+    target_paths = list(target_paths)
+    if not target_paths:
+        return {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(triage_package, target_paths, chunksize=8)
+        return dict(zip(target_paths, results))
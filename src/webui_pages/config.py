@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
-from src.porvider import Provider, llms_list, util_agents
+from src.porvider import Provider, llms_list, resolve_agent, util_agents
+from src.utils.jobs import job_runner
 import os
 
 
@@ -25,25 +26,121 @@ with st.container():
         llm.config_ui()
 
 
-def explore_file(dir_path_list, path_names):
-    with st.empty():
-        length = len(dir_path_list)
-        cols = st.columns(length)
-        for i in range(length):
-            with cols[i]:
-                df = pd.DataFrame(dir_path_list[i], columns=[path_names[i]])
-                st.dataframe(df)
+def pipeline_state():
+    from src.utils.state import PipelineState
+
+    return PipelineState(
+        st.session_state.get("pipeline_state_path", "./data/pipeline_state.sqlite3")
+    )
+
+
+def discover_archives(raw_dir):
+    # lists the raw directory, so only on Inspect and Unzip, never on a plain rerun
+    from src.agents.unzip import archive_stem, list_archives
+
+    if raw_dir and os.path.isdir(raw_dir):
+        pipeline_state().discover(
+            "unzip", [archive_stem(os.path.basename(p)) for p in list_archives(raw_dir)]
+        )
+
+
+def show_state():
+    """
+    Shows the per-stage counts of the pipeline state store and one page of its items.
+    """
+    state = pipeline_state()
+    st.dataframe(pd.DataFrame(state.counts()).fillna(0).astype(int))
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        stage = st.selectbox("Stage", ["", "unzip", "analyze", "import"])
+    with col2:
+        status = st.selectbox("Status", ["", "pending", "running", "done", "failed"])
+    with col3:
+        page = st.number_input("Page", min_value=1, value=1, key="state_page")
+    rows, total = state.items(stage, status, limit=50, offset=(page - 1) * 50)
+    st.caption(f"{total} items")
+    st.dataframe(
+        pd.DataFrame(
+            rows,
+            columns=[
+                "name",
+                "stage",
+                "status",
+                "started",
+                "finished",
+                "seconds",
+                "error",
+            ],
+        ),
+        use_container_width=True,
+    )
+
+
+def unzip_job(agent, zip_dir, unzip_dir):
+    yield from agent.invoke(zip_dir, unzip_dir)
+    return {os.path.basename(path): error for path, error in agent.errors.items()}
+
 
+def analyze_job(agent, unzip_dir, result_dir, **options):
+    yield from agent.invoke(unzip_dir, result_dir, **options)
+    return dict(agent.errors)
 
-def explore_dir(dir_path_list):
-    dirs = []
-    path_names = []
-    for dir_path in dir_path_list:
-        if os.path.exists(dir_path):
-            path_name = os.path.basename(dir_path)
-            path_names.append(path_name)
-            dirs.append(os.listdir(dir_path))
-    explore_file(dirs, path_names)
+
+def import_job(query_agent, **options):
+    from src.utils.data import add_document
+
+    errors = yield from add_document(**options)
+    if query_agent is not None:
+        query_agent.invalidate_cache()
+    return errors
+
+
+def submit_job(name, fn, *args, key=None, **kwargs):
+    job_id = job_runner.submit(
+        Provider.session_id(), name, fn, *args, key=key, **kwargs
+    )
+    st.session_state.setdefault("jobs", []).append(job_id)
+    st.session_state.show_state = True
+
+
+@st.experimental_fragment(run_every=2)
+def show_jobs():
+    """
+    Polls the background jobs of this session (or of all sessions) with their
+    progress, throughput and ETA.
+    """
+    all_sessions = st.checkbox("All Sessions", value=False)
+    if all_sessions:
+        jobs = job_runner.list()
+    else:
+        jobs = [
+            job
+            for job in map(job_runner.get, st.session_state.get("jobs", []))
+            if job is not None
+        ]
+    if not jobs:
+        st.caption("No jobs.")
+        return
+    for job in reversed(jobs):
+        progress = job.progress()
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            text = f"{job.name} ({progress['status']}) {job.done}/{job.total}"
+            if progress["per_second"]:
+                text += f", {progress['per_second']}/s"
+            if progress["eta"] is not None:
+                text += f", ETA {progress['eta']}s"
+            st.progress(job.done / job.total if job.total else 0.0, text=text)
+            if job.error:
+                st.error(job.error)
+            elif job.result:
+                with st.expander(f"{len(job.result)} errors"):
+                    for name, error in job.result.items():
+                        st.warning(f"{name}: {error}")
+        with col2:
+            if progress["status"] in ("queued", "running"):
+                if st.button("Cancel", key=f"cancel_{job.id}"):
+                    job_runner.cancel(job.id)
 
 
 with st.container(border=True):
@@ -74,51 +171,99 @@ with st.container(border=True):
                     "Analysis File Path", value="data/analysis"
                 )
                 analysis_unzip = st.button("Analyze")
+                report = st.button("Report")
             with col4:
                 vectorstore_path = st.text_input(
                     "Vectorstore Path", value="data/attack_vector.xlsx"
                 )
+                max_workers = st.number_input(
+                    "Concurrency", min_value=1, max_value=64, value=4
+                )
+                token_budget = st.number_input(
+                    "Token Budget", min_value=1000, max_value=128000, value=6000
+                )
+                structured = st.checkbox("Structured Output", value=False)
+                triage_enabled = st.checkbox("Static Triage", value=False)
+                triage_threshold = st.number_input(
+                    "Triage Threshold", min_value=1, max_value=50, value=3
+                )
+                dedup_enabled = st.checkbox("Cluster Near-duplicates", value=False)
+                dedup_threshold = st.number_input(
+                    "Similarity Threshold", min_value=0.5, max_value=1.0, value=0.8
+                )
 
+            if unzip or inspect:
+                discover_archives(raw_file_path)
             if unzip:
-                if Provider.get_agent("unzip"):
-                    llm_name = Provider.get_current_llm()[1]
-                    if "gpt" not in llm_name:
-                        st.error("Please select a GPT model to unzip.")
-                    else:
-                        try:
-                            with st.spinner("Unzip..."):
-                                Provider.get_agent("unzip").invoke(
-                                    raw_file_path, unzip_file_path
-                                )
-                                explore_dir(
-                                    [raw_file_path, unzip_file_path, analysis_file_path]
-                                )
-                        except Exception as e:
-                            st.error(e)
-                else:
-                    st.write("Please configure the app first.")
+                # extraction is deterministic, so no model has to be configured
+                unzip_agent = Provider.get_agent("unzip")
+                if unzip_agent is None:
+                    unzip_agent = resolve_agent("unzip")()
+                    unzip_agent.load_state(pipeline_state().path)
+                # jobs on the same agent or directory run one after another
+                submit_job(
+                    "Unzip",
+                    unzip_job,
+                    unzip_agent,
+                    raw_file_path,
+                    unzip_file_path,
+                    key=f"unzip:{os.path.abspath(unzip_file_path)}",
+                )
             if inspect:
-                explore_dir([raw_file_path, unzip_file_path, analysis_file_path])
+                st.session_state.show_state = True
 
             if analysis_unzip:
                 if Provider.get_agent("analyze"):
-                    analyze_progress_text = "Analyze..."
-                    analyze_bar = st.progress(0, text=analyze_progress_text)
-
-                    try:
-                        for i, length in Provider.get_agent("analyze").invoke(
-                            unzip_file_path, analysis_file_path
-                        ):
-                            analyze_bar.progress(i / length, text=analyze_progress_text)
-                        explore_dir(
-                            [raw_file_path, unzip_file_path, analysis_file_path]
-                        )
-                    except Exception as e:
-                        st.error(e)
-                    analyze_bar.empty()
+                    analyze_agent = Provider.get_agent("analyze")
+                    submit_job(
+                        "Analyze",
+                        analyze_job,
+                        analyze_agent,
+                        unzip_file_path,
+                        analysis_file_path,
+                        key=f"analyze:{id(analyze_agent)}",
+                        max_workers=int(max_workers),
+                        token_budget=int(token_budget),
+                        triage_threshold=(
+                            int(triage_threshold) if triage_enabled else None
+                        ),
+                        structured=structured,
+                        dedup_threshold=(
+                            float(dedup_threshold) if dedup_enabled else None
+                        ),
+                    )
                 else:
                     st.write("Please configure the app first.")
 
+            with st.expander("Jobs", expanded=True):
+                show_jobs()
+
+            if report:
+                from src.utils.store import ResultStore
+
+                store = ResultStore(
+                    st.session_state.get(
+                        "result_store_path", "./data/analysis_results.sqlite3"
+                    )
+                )
+                report_path = analysis_file_path.rstrip("/") + "_report.xlsx"
+                try:
+                    rows = store.export_report(report_path)
+                    st.write(f"Exported {rows} analyses to {report_path}")
+                    st.dataframe(
+                        pd.DataFrame(
+                            store.ttp_frequency(),
+                            columns=["ecosystem", "TTP", "packages"],
+                        ),
+                        use_container_width=True,
+                    )
+                except Exception as e:
+                    st.error(e)
+
+            # kept across reruns, so the filters and pages work without pressing Inspect again
+            if st.session_state.get("show_state"):
+                show_state()
+
     with st.container():
         st.header("Chromadb Inspector")
         if os.environ.get("GenTTP", False):
@@ -128,17 +273,46 @@ with st.container(border=True):
             database_path = st.text_input("Database Path", value="data/chroma_database")
 
         def inspect_collection(collection_name):
-            collection = Provider.get_collection(collection_name)
-            result = collection.get(include=["embeddings", "documents", "metadatas"])
-            df = pd.DataFrame(
-                {
-                    "ids": result["ids"],
-                    "embeddings": result["embeddings"],
-                    "documents": result["documents"],
-                    "metadatas": result["metadatas"],
-                }
-            )
-            st.dataframe(df)
+            from src.utils.data import inspect_page, parse_where
+
+            col1, col2, col3 = st.columns([2, 2, 1])
+            with col1:
+                where_text = st.text_input(
+                    "Metadata Filter", placeholder="package_name=foo, ttp_cmd=true"
+                )
+            with col2:
+                contains = st.text_input("Text Filter")
+            with col3:
+                page_size = st.selectbox("Page Size", [25, 50, 100, 200], index=1)
+            full_documents = st.checkbox("Full Documents", value=False)
+            show_embeddings = st.checkbox("Embedding Summary", value=False)
+            try:
+                collection = Provider.get_collection(collection_name)
+                where = parse_where(where_text)
+                # the first page also returns the total, which sizes the page selector
+                page = st.session_state.get("inspect_page", 1)
+                rows, total = inspect_page(
+                    collection,
+                    limit=page_size,
+                    offset=(page - 1) * page_size,
+                    where=where,
+                    contains=contains or None,
+                    preview_chars=None if full_documents else 300,
+                    embeddings=show_embeddings,
+                )
+                pages = max((total + page_size - 1) // page_size, 1)
+                if page > pages:
+                    st.session_state.inspect_page = 1
+                    st.rerun()
+                st.number_input(
+                    f"Page (of {pages}, {total} documents)",
+                    min_value=1,
+                    max_value=pages,
+                    key="inspect_page",
+                )
+                st.dataframe(pd.DataFrame(rows), use_container_width=True)
+            except Exception as e:
+                st.error(e)
 
         if st.button("Reload Chromadb") or os.environ.get("GenTTP", False):
             Provider.init_database(database_path)
@@ -163,11 +337,22 @@ with st.container(border=True):
         if not os.environ.get("GenTTP", False):
             with col3:
                 import_btn = st.button("Import")
+            with st.expander("Import Settings", expanded=False):
+                import_batch_size = st.number_input(
+                    "Batch Size", min_value=1, max_value=512, value=32
+                )
+                import_rpm = st.number_input(
+                    "Requests Per Minute", min_value=1, max_value=6000, value=60
+                )
+                remove_deleted = st.checkbox(
+                    "Remove documents of deleted files", value=False
+                )
         else:
             import_btn = False
 
         if chromadb_inspect and collection_name:
-            inspect_collection(collection_name)
+            st.session_state.inspected_collection = collection_name
+            st.session_state.inspect_page = 1
 
         if (load_collection and collection_name) or os.environ.get("GenTTP", False):
             Provider.register_collection(collection_name)
@@ -181,15 +366,25 @@ with st.container(border=True):
                 embedding_function=Provider.get_current_embedding()[0],
             )
 
-            from src.utils.data import add_document
+            from src.utils.data import collection_manifest_path
 
-            import_progress_text = "Importing..."
-            import_bar = st.progress(0, text=import_progress_text)
-            for i, length in add_document(
+            manifest_path = collection_manifest_path(database_path, collection_name)
+            submit_job(
+                "Import",
+                import_job,
+                Provider.get_agent("query"),
+                key=f"import:{os.path.abspath(manifest_path)}",
                 collection=collection,
                 embedding=Provider.get_current_embedding()[0],
                 input_dir=analysis_file_path,
-            ):
-                import_bar.progress(i / length, text=import_progress_text)
-            import_bar.empty()
-            inspect_collection(collection_name)
+                batch_size=int(import_batch_size),
+                requests_per_minute=int(import_rpm),
+                manifest_path=manifest_path,
+                remove_deleted=remove_deleted,
+                state=pipeline_state(),
+            )
+            st.session_state.inspected_collection = collection_name
+
+        # kept across reruns, so paging and filtering do not need the Inspect button again
+        if st.session_state.get("inspected_collection"):
+            inspect_collection(st.session_state.inspected_collection)
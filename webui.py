@@ -1,4 +1,5 @@
 import os
+
 if os.environ.get("GenTTP", False):
     __import__("pysqlite3")
     import sys
@@ -23,6 +24,9 @@ def main():
 
     pg.run()
 
+    if os.environ.get("GenTTP_PREWARM", False):
+        Provider.prewarm()
+
     with st.sidebar:
         st.write("LLM: ", Provider.get_current_llm()[1])
         st.write("Embedding: ", Provider.get_current_embedding()[1])
@@ -34,6 +38,17 @@ def main():
         else:
             for agent in st.session_state.agent:
                 st.write("Agent: ", agent)
+        with st.expander("Metrics"):
+            from src.utils.metrics import metrics
+
+            snapshot = metrics.snapshot()
+            if snapshot["latencies"]:
+                st.dataframe(snapshot["latencies"], hide_index=True)
+            if snapshot["models"]:
+                st.dataframe(snapshot["models"], hide_index=True)
+            if st.button("Export Metrics"):
+                events = metrics.export("data/metrics.jsonl", "data/metrics.prom")
+                st.write(f"Exported {events} events to data/metrics.jsonl")
 
 
 if __name__ == "__main__":